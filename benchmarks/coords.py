@@ -0,0 +1,71 @@
+"""
+Micro-benchmark for parsing and serializing PageXML coords strings.
+
+Compares the Polygon implementation against the former list[Point] approach (one Point per vertex, split and
+int-parse per "x,y" pair). Run from the repository root:
+
+    python -m benchmarks.coords
+"""
+import random
+import timeit
+import tracemalloc
+
+from helper.geometry import Point, Polygon
+
+
+class DictPoint:
+    """ Point with per-instance __dict__, as before """
+    def __init__(self, x: int, y: int):
+        self._x = x
+        self._y = y
+
+
+def reference_parse(coords: str) -> list[DictPoint]:
+    """ Former Polygon.from_page_coords """
+    return list([DictPoint(*map(int, xy.split(','))) for xy in coords.split(' ')])
+
+
+def reference_serialize(points: list[DictPoint]) -> str:
+    """ Former Polygon.to_page_coords """
+    return ' '.join([f'{p._x},{p._y}' for p in points])
+
+
+def coords_string(vertices: int, seed: int = 0) -> str:
+    """ Returns a random PageXML coords string with the given number of vertices """
+    rnd = random.Random(seed)
+    return ' '.join(f'{rnd.randint(0, 6000)},{rnd.randint(0, 9000)}' for _ in range(vertices))
+
+
+def allocated(func) -> int:
+    """ Returns number of bytes still allocated by the result of func """
+    tracemalloc.start()
+    result = func()
+    size = tracemalloc.get_traced_memory()[0]
+    tracemalloc.stop()
+    del result
+    return size
+
+
+def main(vertices: tuple[int, ...] = (4, 50, 300, 1000), number: int = 2000) -> None:
+    print(f'{"vertices":>8} {"parse old":>12} {"parse new":>12} {"write old":>12} {"write new":>12} '
+          f'{"mem old":>10} {"mem new":>10}')
+    for n in vertices:
+        coords = coords_string(n)
+        points, polygon = reference_parse(coords), Polygon.from_page_coords(coords)
+        assert reference_serialize(points) == polygon.to_page_coords() == coords
+        timings = [timeit.timeit(f, number=number) / number * 1e6 for f in (
+            lambda: reference_parse(coords),
+            lambda: Polygon.from_page_coords(coords),
+            lambda: reference_serialize(points),
+            lambda: polygon.to_page_coords()
+        )]
+        memory = allocated(lambda: reference_parse(coords)), allocated(lambda: Polygon.from_page_coords(coords))
+        print(f'{n:>8} ' + ' '.join(f'{t:>10.1f}us' for t in timings) + f' {memory[0]:>9}B {memory[1]:>9}B')
+
+    slotted, legacy = allocated(lambda: [Point(i, i) for i in range(10000)]), \
+        allocated(lambda: [DictPoint(i, i) for i in range(10000)])
+    print(f'10000 Point objects: {legacy}B with __dict__, {slotted}B with __slots__')
+
+
+if __name__ == '__main__':
+    main()
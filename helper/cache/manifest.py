@@ -0,0 +1,39 @@
+import hashlib
+import json
+import os
+from pathlib import Path
+
+
+def file_hash(fp: Path) -> str:
+    """ Returns sha1 hex digest of a file """
+    with open(fp, 'rb') as f:
+        return hashlib.file_digest(f, 'sha1').hexdigest()
+
+
+class Manifest:
+    def __init__(self, fp: Path):
+        """
+        Small JSON sidecar file, mapping file names to records of the last run
+
+        :param fp: path to manifest file, loaded if it exists
+        """
+        self.fp: Path = fp
+        self.files: dict[str, dict] = {}
+        if fp.exists():
+            with open(fp, 'r', encoding='utf-8') as f:
+                self.files = json.load(f).get('files', {})
+
+    def get(self, name: str) -> dict | None:
+        """ Returns record of a file or None """
+        return self.files.get(name)
+
+    def set(self, name: str, record: dict) -> None:
+        """ Sets record of a file """
+        self.files[name] = record
+
+    def save(self) -> None:
+        """ Writes manifest atomically """
+        tmp = self.fp.with_name(f'{self.fp.name}.tmp')
+        with open(tmp, 'w', encoding='utf-8') as f:
+            json.dump({'files': self.files}, f, indent=1, sort_keys=True)
+        os.replace(tmp, self.fp)
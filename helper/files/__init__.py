@@ -0,0 +1 @@
+from .copy import COPY_MODES, copy_file
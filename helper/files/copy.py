@@ -0,0 +1,64 @@
+import os
+import shutil
+import uuid
+from pathlib import Path
+
+from helper.profiling import stage
+
+COPY_MODES = ['copy', 'hardlink', 'reflink']
+FICLONE = 0x40049409  # Linux ioctl to share the data blocks of a file (btrfs, xfs, ...)
+
+
+def _reflink(src: Path, dst: Path) -> None:
+    """ Creates a copy-on-write clone of src at a new path dst, raises OSError if not supported """
+    import fcntl
+    with open(src, 'rb') as s, open(dst, 'wb') as d:
+        fcntl.ioctl(d.fileno(), FICLONE, s.fileno())
+
+
+def copy_file(src: Path, dst: Path, mode: str = 'copy') -> str:
+    """
+    Copies a file, replacing an existing destination. Hardlinks and reflinks only work within the same filesystem
+    (reflinks also need filesystem support), otherwise the file is copied.
+
+    :param src: source file
+    :param dst: destination file
+    :param mode: copy, hardlink or reflink
+    :return: mode actually used
+    """
+    with stage('io'):
+        return _copy_file(src, dst, mode)
+
+
+def _copy_file(src: Path, dst: Path, mode: str) -> str:
+    if mode not in COPY_MODES:
+        raise ValueError(f'Unknown copy mode: {mode}')
+    if os.path.realpath(src) == os.path.realpath(dst):
+        raise ValueError(f'Source and destination are the same file: {src}')
+    # never write into dst: it may be a hardlink to another file (earlier runs, concurrent copies to the same path),
+    # create a new file under a unique name instead and rename it over dst
+    tmp = dst.with_name(f'.{dst.name}.{uuid.uuid4().hex[:8]}.tmp')
+    try:
+        used = _copy_new(src, tmp, mode)
+        os.replace(tmp, dst)
+    finally:
+        tmp.unlink(missing_ok=True)
+    return used
+
+
+def _copy_new(src: Path, dst: Path, mode: str) -> str:
+    """ Copies src to a path dst that does not exist yet """
+    if mode == 'hardlink':
+        try:
+            os.link(src, dst)
+            return mode
+        except OSError:
+            pass
+    elif mode == 'reflink':
+        try:
+            _reflink(src, dst)
+            return mode
+        except (OSError, ImportError):
+            dst.unlink(missing_ok=True)
+    shutil.copy(src, dst)
+    return 'copy'
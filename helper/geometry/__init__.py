@@ -1,2 +1,3 @@
-from .point import Point
-from .polygon import Polygon
\ No newline at end of file
+from .point import Point, PointView
+from .polygon import Polygon
+from .spatial import SpatialIndex
@@ -1,4 +1,4 @@
-from typing import Self
+from typing import Callable, Self
 
 
 class Point:
@@ -9,6 +9,8 @@ class Point:
      |      |
     0,y -- x,y
     """
+    __slots__ = ('_x', '_y')
+
     def __init__(self, x: int, y: int):
         self._x: int = x
         self._y: int = y
@@ -42,8 +44,8 @@ class Point:
     @classmethod
     def from_string(cls, xy: str) -> Self:
         """ Creates a Point object from a string of the form 'x,y'. """
-        x, y = map(int, xy.split(','))
-        return cls(x, y)
+        x, _, y = xy.partition(',')
+        return cls(int(x), int(y))
 
     @classmethod
     def from_int(cls, x: int, y: int) -> Self:
@@ -63,3 +65,36 @@ class Point:
     def to_tuple(self) -> tuple[int, int]:
         """ Returns a tuple of the form (x, y). """
         return self._x, self._y
+
+
+class PointView(Point):
+    """
+    Point referencing a row of a coordinate array of shape (N, 2). Changes are written to the array
+    and reported to the optional on_change callback.
+    """
+    __slots__ = ('_coords', '_index', '_on_change')
+
+    def __init__(self, coords, index: int, on_change: Callable[[], None] | None = None):
+        self._coords = coords
+        self._index: int = index
+        self._on_change = on_change
+
+    @property
+    def _x(self) -> int:
+        return int(self._coords[self._index, 0])
+
+    @_x.setter
+    def _x(self, x: int):
+        self._coords[self._index, 0] = x
+        if self._on_change is not None:
+            self._on_change()
+
+    @property
+    def _y(self) -> int:
+        return int(self._coords[self._index, 1])
+
+    @_y.setter
+    def _y(self, y: int):
+        self._coords[self._index, 1] = y
+        if self._on_change is not None:
+            self._on_change()
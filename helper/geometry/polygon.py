@@ -1,67 +1,81 @@
-from typing import Self
+from functools import lru_cache
+from typing import Iterator, Self
 
+import numpy as np
+import shapely
 from shapely.geometry import Polygon as ShapelyPolygon
-from shapely.geometry import Point as ShapelyPoint
 
-from .point import Point
+from .point import Point, PointView
+
+
+@lru_cache(maxsize=1024)
+def _page_coords_template(n: int) -> str:
+    """ Returns format string for n points in PageXML coords format, cached per number of points """
+    return ' '.join(['{},{}'] * n)
 
 
 class Polygon:
-    def __init__(self, points: list[Point]):
-        self._points: list[Point] = points
+    """
+    Polygon stored as contiguous int32 array of shape (N, 2) with one (x, y) row per vertex.
+    The Shapely geometry is created lazily, cached and dropped when a vertex changes.
+    """
+    def __init__(self, points: list[Point] | np.ndarray):
+        if isinstance(points, np.ndarray):
+            self._coords: np.ndarray = np.ascontiguousarray(points, dtype=np.int32).reshape(-1, 2)
+        else:
+            self._coords: np.ndarray = np.array([p.to_tuple() for p in points], dtype=np.int32).reshape(-1, 2)
+        self._shape: ShapelyPolygon | None = None
+
+    def _invalidate(self) -> None:
+        """ Drops cached geometry after coordinates changed """
+        self._shape = None
 
     def __str__(self):
-        return f'Polygon({" ".join(map(str, self._points))})'
+        return f'Polygon({" ".join(map(str, self))})'
 
     def __repr__(self):
-        return ' '.join(map(str, self._points))
-
-    def __iter__(self) -> Self:
-        """ Iterate through the list of points """
-        self.__n = 0
-        return self
-
-    def __next__(self) -> Point:
-        """ Iterate through the list of points """
-        if self.__n < len(self._points):
-            point = self._points[self.__n]
-            self.__n += 1
-            return point
-        else:
-            raise StopIteration
+        return ' '.join(map(str, self))
+
+    def __len__(self) -> int:
+        """ Number of vertices """
+        return len(self._coords)
+
+    def __iter__(self) -> Iterator[PointView]:
+        """ Iterate through the list of points. Changes to the points are written back to the polygon """
+        return (PointView(self._coords, i, self._invalidate) for i in range(len(self._coords)))
 
     @classmethod
     def from_page_coords(cls, coords: str) -> Self:
         """ Creates Polygon object from PageXML coords string """
-        points = list(map(Point.from_string, coords.split(' ')))
-        return cls(points)
+        coords = coords.strip()
+        array = np.fromstring(coords.replace(' ', ','), dtype=np.int32, sep=',')
+        if len(array) != 2 * (coords.count(',')):  # numpy stops at invalid data instead of raising
+            raise ValueError(f'Invalid coords string: {coords}')
+        return cls(array)
 
     def to_page_coords(self) -> str:
         """ Returns coordinates as a string compatible with PageXML """
-        return ' '.join([p.to_string() for p in self._points])
+        return _page_coords_template(len(self._coords)).format(*self._coords.ravel().tolist())
 
     @classmethod
     def from_bbox(cls, coords: list[int | str]) -> Self:
         """ Creates Polygon object from a bbox in list format """
-        return cls([
-            Point.from_int(int(coords[0]), int(coords[1])),
-            Point.from_int(int(coords[0]) + int(coords[2]), int(coords[1])),
-            Point.from_int(int(coords[0]) + int(coords[2]), int(coords[1]) + int(coords[3])),
-            Point.from_int(int(coords[0]), int(coords[1]) + int(coords[3]))
-        ])
-    
+        x, y, w, h = map(int, coords[:4])
+        return cls(np.array([[x, y], [x + w, y], [x + w, y + h], [x, y + h]]))
+
     @classmethod
     def from_coco(cls, coords: list[int]) -> Self:
-        return cls(list([Point.from_int(int(coords[i]), int(coords[i+1])) for i in range(0, len(coords), 2)]))
+        """ Creates Polygon object from a flat COCO segmentation list [x1, y1, x2, y2, ...] """
+        return cls(np.asarray(coords).astype(np.int32))
 
     @classmethod
     def from_tuple_list(cls, coords: list[tuple]) -> Self:
         """ Creates Polygon from list of tuples of type (x, y) """
-        return cls(list([Point.from_tuple(x) for x in coords]))
+        return cls(np.asarray(coords).astype(np.int32))
 
     def to_tuple_list(self) -> list[tuple]:
         """ Returns a list of tuples in (x, y) format """
-        return list([x.to_tuple() for x in self._points])
+        return list(map(tuple, self._coords.tolist()))
 
     @classmethod
     def from_point_list(cls, coords: list[Point]):
@@ -70,13 +84,81 @@ class Polygon:
 
     def to_point_list(self) -> list[Point]:
         """ Returns a list with Point objects """
-        return self._points.copy()
+        return list(self)
+
+    @classmethod
+    def from_array(cls, coords: np.ndarray) -> Self:
+        """ Creates Polygon object from an array of shape (N, 2) """
+        return cls(coords)
+
+    def to_array(self) -> np.ndarray:
+        """ Returns a copy of the coordinates as int32 array of shape (N, 2) """
+        return self._coords.copy()
+
+    def bbox(self) -> tuple[int, int, int, int]:
+        """ Returns bounding box as (min x, min y, max x, max y) """
+        (x0, y0), (x1, y1) = self._coords.min(axis=0).tolist(), self._coords.max(axis=0).tolist()
+        return x0, y0, x1, y1
+
+    def clip(self, min_x: int = 0, min_y: int = 0, max_x: int | None = None, max_y: int | None = None) -> Self:
+        """ Returns a new polygon with all coordinates clipped to the given bounds (None: unbounded) """
+        upper = np.array([np.iinfo(np.int32).max if max_x is None else max_x,
+                          np.iinfo(np.int32).max if max_y is None else max_y])
+        return self.__class__(np.clip(self._coords, [min_x, min_y], upper))
+
+    def translate(self, dx: int = 0, dy: int = 0) -> Self:
+        """ Returns a new polygon moved by dx, dy """
+        return self.__class__(self._coords + np.array([dx, dy], dtype=np.int32))
+
+    def centroid(self) -> tuple[float, float]:
+        """ Returns geometric center of polygon (area weighted, mean of vertices for polygons without area) """
+        xy = self._coords.astype(np.float64)
+        x, y = xy[:, 0], xy[:, 1]
+        x1, y1 = np.roll(x, -1), np.roll(y, -1)
+        cross = x * y1 - x1 * y
+        area = cross.sum()
+        if area == 0:
+            return float(x.mean()), float(y.mean())
+        return float(((x + x1) * cross).sum() / (3 * area)), float(((y + y1) * cross).sum() / (3 * area))
 
     def center(self) -> Point:
         """ Returns geometric center of polygon """
-        center = ShapelyPolygon(self.to_tuple_list()).centroid
-        return Point.from_tuple((round(center.x), round(center.y)))
+        x, y = self.centroid()
+        return Point.from_tuple((round(x), round(y)))
+
+    @staticmethod
+    def centers(polygons: list['Polygon']) -> np.ndarray:
+        """ Returns geometric centers of multiple polygons as int array of shape (N, 2), same as center() """
+        if not polygons:
+            return np.empty((0, 2), dtype=np.int64)
+        centroids = shapely.centroid(np.array([p.to_shapely() for p in polygons], dtype=object))
+        xy = np.stack([shapely.get_x(centroids), shapely.get_y(centroids)], axis=1)
+        if np.isnan(xy).any():  # polygons without area have an empty centroid
+            for i in np.flatnonzero(np.isnan(xy).any(axis=1)):
+                xy[i] = polygons[i]._coords.mean(axis=0)
+        return np.rint(xy).astype(np.int64)
+
+    def to_shapely(self) -> ShapelyPolygon:
+        """ Returns cached (and prepared) Shapely polygon """
+        if self._shape is None:
+            self._shape = ShapelyPolygon(self._coords)
+            shapely.prepare(self._shape)
+        return self._shape
+
+    @classmethod
+    def from_shapely(cls, shape: ShapelyPolygon) -> Self:
+        """ Creates polygon from exterior of a Shapely polygon, coordinates are rounded to integers """
+        xy = shapely.get_coordinates(shape.exterior)[:-1]  # without closing point
+        return cls(np.rint(xy).astype(np.int32))
 
     def contains(self, point: Point | tuple) -> bool:
         """ Checks, if a point is within this polygon. Accepts Point object or tuple (x, y)"""
-        return ShapelyPolygon(self.to_tuple_list()).contains(ShapelyPoint((point.x, point.y)))
+        x, y = point if isinstance(point, tuple) else (point.x, point.y)
+        return bool(shapely.contains_xy(self.to_shapely(), x, y))
+
+    def contains_many(self, points: np.ndarray | list[Point | tuple]) -> np.ndarray:
+        """ Checks for multiple points if they are within this polygon. Returns bool array """
+        if not isinstance(points, np.ndarray):
+            points = np.array([p if isinstance(p, tuple) else (p.x, p.y) for p in points], dtype=np.float64)
+        points = points.reshape(-1, 2)
+        return shapely.contains_xy(self.to_shapely(), points[:, 0], points[:, 1])
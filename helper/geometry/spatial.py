@@ -0,0 +1,96 @@
+import numpy as np
+import shapely
+
+from .polygon import Polygon
+
+
+class SpatialIndex:
+    def __init__(self, polygons: list[Polygon]):
+        """
+        STRtree backed spatial index over a list of polygons. Results refer to polygons by their list index.
+        Invalid polygons (e.g. self-intersecting masks) are repaired for area computations.
+
+        :param polygons: list of polygons
+        """
+        geoms = np.array([p.to_shapely() for p in polygons], dtype=object)
+        if len(geoms) and not (valid := shapely.is_valid(geoms)).all():
+            geoms[~valid] = shapely.make_valid(geoms[~valid])
+        self.__geoms = geoms
+        self.__tree = shapely.STRtree(geoms)
+
+    def __len__(self) -> int:
+        return len(self.__geoms)
+
+    def overlapping(self, threshold: float = 0.0, metric: str = 'iou') -> np.ndarray:
+        """
+        Finds pairs of intersecting polygons with an overlap above a threshold
+
+        :param threshold: minimum overlap, pairs have to share some area in any case
+        :param metric: iou (intersection over union) or overlap (intersection over area of the smaller polygon)
+        :return: int array of shape (K, 2) with index pairs i < j
+        """
+        left, right = self.__tree.query(self.__geoms, predicate='intersects')
+        mask = left < right
+        left, right = left[mask], right[mask]
+        inter = shapely.area(shapely.intersection(self.__geoms[left], self.__geoms[right]))
+        area_left, area_right = shapely.area(self.__geoms[left]), shapely.area(self.__geoms[right])
+        if metric == 'iou':
+            denominator = area_left + area_right - inter
+        elif metric == 'overlap':
+            denominator = np.minimum(area_left, area_right)
+        else:
+            raise ValueError(f'Unknown overlap metric: {metric}')
+        ratio = np.divide(inter, denominator, out=np.zeros_like(inter), where=denominator > 0)
+        keep = (inter > 0) & (ratio >= threshold)
+        return np.stack([left[keep], right[keep]], axis=1)
+
+    def clusters(self, threshold: float = 0.0, metric: str = 'iou') -> list[list[int]]:
+        """
+        Groups transitively overlapping polygons (see overlapping)
+
+        :param threshold: minimum overlap of two polygons to be grouped
+        :param metric: iou or overlap
+        :return: list of groups, each group and the list itself sorted by polygon index
+        """
+        parent = list(range(len(self.__geoms)))
+
+        def find(i: int) -> int:
+            while parent[i] != i:
+                parent[i] = parent[parent[i]]
+                i = parent[i]
+            return i
+
+        for i, j in self.overlapping(threshold, metric).tolist():
+            root_i, root_j = find(i), find(j)
+            if root_i != root_j:
+                parent[max(root_i, root_j)] = min(root_i, root_j)
+        groups: dict[int, list[int]] = {}
+        for i in range(len(parent)):
+            groups.setdefault(find(i), []).append(i)
+        return list(groups.values())
+
+    def containing(self, points: np.ndarray) -> np.ndarray:
+        """
+        Finds the polygon containing each point, the smallest one if there are several (the one with the lowest
+        index if they have the same area), so nested polygons take precedence over the ones around them
+
+        :param points: array of shape (N, 2)
+        :return: int array of shape (N,) with polygon index, -1 for points outside of all polygons
+        """
+        points = np.asarray(points, dtype=np.float64).reshape(-1, 2)
+        point_idx, geom_idx = self.__tree.query(shapely.points(points), predicate='within')
+        order = np.lexsort((geom_idx, shapely.area(self.__geoms[geom_idx]), point_idx))
+        point_idx, geom_idx = point_idx[order], geom_idx[order]
+        first = np.unique(point_idx, return_index=True)[1]  # best match of each point comes first
+        result = np.full(len(points), -1, dtype=np.intp)
+        result[point_idx[first]] = geom_idx[first]
+        return result
+
+    def hull(self, indices: list[int]) -> Polygon:
+        """
+        Returns convex hull of the union of some polygons
+
+        :param indices: polygon indices
+        :return: integer polygon
+        """
+        return Polygon.from_shapely(shapely.convex_hull(shapely.union_all(self.__geoms[indices])))
@@ -1,4 +1,6 @@
-from pagexml import Page, Element
+from typing import Iterator
+
+from pagexml import PageXML, Page, Element, ElementType
 from helper.geometry import Polygon
 
 
@@ -21,3 +23,48 @@ def get_coords_element(element: Element) -> Element | None:
     for e in element:
         return e
     return None
+
+
+def get_element_text(text_line: Element) -> str:
+    """
+    Extracts text from a TextLine element, same rules as helper.stream.get_line_text
+
+    :param text_line: TextLine element
+    :return: text of the line, empty string if nothing found
+    """
+    equiv = None
+    for child in text_line:
+        if child.etype != ElementType.TextEquiv:
+            continue
+        if ('index' not in child) or child['index'] == '0':
+            equiv = child
+            break
+        if equiv is None:
+            equiv = child
+    if equiv is None:
+        return ''
+    unicode = next((e for e in equiv if e.etype == ElementType.Unicode), None)
+    if unicode is None or unicode.text is None:
+        return ''
+    return unicode.text
+
+
+def iter_page_lines(pxml: PageXML) -> Iterator[tuple[str, str]]:
+    """
+    Yields the text of each TextLine of a parsed PageXML object together with the id of its TextRegion,
+    same as helper.stream.iter_text_lines for files
+
+    :param pxml: PageXML object
+    :return: generator of (region id, line text) tuples in document order
+    """
+    def walk(element: Element, region_id: str) -> Iterator[tuple[str, str]]:
+        for e in element:
+            if e.etype == ElementType.TextLine:
+                yield region_id, get_element_text(e)
+            elif e.etype == ElementType.TextRegion:
+                yield from walk(e, e['id'] if 'id' in e else '')
+            else:
+                yield from walk(e, region_id)
+
+    for page in pxml:
+        yield from walk(page, '')
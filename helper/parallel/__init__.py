@@ -0,0 +1 @@
+from .parallel import parallel_map, echo_failures
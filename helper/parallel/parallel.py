@@ -0,0 +1,123 @@
+from collections import deque
+from concurrent.futures import Future, ProcessPoolExecutor, ThreadPoolExecutor, FIRST_COMPLETED, wait
+from typing import Any, Callable, Iterable, Iterator
+
+import click
+
+from helper.profiling import PROFILER
+
+
+def _call(func: Callable, item: Any) -> tuple[Any, str | None]:
+    """ Calls func and returns (result, error message). Errors are formatted here, not all exceptions are picklable """
+    try:
+        return func(item), None
+    except Exception as e:
+        return None, f'{type(e).__name__}: {e}'
+
+
+def _call_profiled(func: Callable, item: Any) -> tuple[Any, str | None, tuple]:
+    """ Like _call, in a worker process with profiling enabled. Also returns the profiler snapshot of this call """
+    PROFILER.enabled = True
+    PROFILER.reset()
+    return *_call(func, item), PROFILER.snapshot()
+
+
+def _result(future: Future) -> tuple[Any, str | None]:
+    """ Returns (result, error message) of a finished _call future, merges profiler snapshot of _call_profiled """
+    try:
+        result, error, *snapshot = future.result()
+    except Exception as e:  # worker died or result not picklable
+        return None, f'{type(e).__name__}: {e}'
+    if snapshot:
+        PROFILER.merge(snapshot[0])
+    return result, error
+
+
+def parallel_map(
+        func: Callable,
+        items: Iterable,
+        jobs: int = 1,
+        label: str = '',
+        max_pending: int | None = None,
+        threads: bool = False,
+        length: int | None = None,
+        ordered: bool = False,
+        initializer: Callable | None = None,
+        initargs: tuple = ()
+) -> Iterator[tuple[Any, Any, str | None]]:
+    """
+    Applies func to every item, in worker processes (or threads) if jobs > 1, behind a click progressbar.
+    Exceptions raised by func do not abort the run, they are returned as error message instead.
+
+    :param func: picklable function (module level) with a single argument
+    :param items: items to process
+    :param jobs: number of workers, process serially in this process if jobs <= 1
+    :param label: label of the progressbar
+    :param max_pending: maximum number of submitted but unfinished items, defaults to 4 * jobs
+    :param threads: use a thread pool instead of a process pool, for work that releases the GIL
+    :param length: number of items, if set, items are consumed lazily instead of being collected into a list first
+    :param ordered: yield results in order of items instead of order of completion. Finished results wait for
+        their predecessors, at most max_pending items are in flight.
+    :param initializer: called once in each worker (and once in this process if jobs <= 1) with initargs, e.g. to
+        install large shared state, which is then sent once per worker instead of once per item
+    :param initargs: arguments of initializer
+    :return: generator of (item, result, error) tuples in order of completion (or items if ordered)
+    """
+    if length is None:
+        items = list(items)
+        length = len(items)
+    with click.progressbar(length=length, label=label, show_pos=True, show_eta=True, show_percent=True) as bar:
+        if jobs <= 1:
+            if initializer is not None:
+                initializer(*initargs)
+            for item in items:
+                yield item, *_call(func, item)
+                bar.update(1)
+            return
+
+        max_pending = max(jobs, max_pending or 4 * jobs)
+        call = _call_profiled if PROFILER.enabled and not threads else _call  # threads share the profiler
+        queue = iter(items)
+        with (ThreadPoolExecutor if threads else ProcessPoolExecutor)(max_workers=jobs, initializer=initializer,
+                                                                      initargs=initargs) as executor:
+            if ordered:
+                in_order: deque[tuple[Future, Any]] = deque()
+                for item in queue:
+                    in_order.append((executor.submit(call, func, item), item))
+                    if len(in_order) >= max_pending:
+                        future, item = in_order.popleft()
+                        yield item, *_result(future)
+                        bar.update(1)
+                while in_order:
+                    future, item = in_order.popleft()
+                    yield item, *_result(future)
+                    bar.update(1)
+                return
+
+            pending = {}
+            while True:
+                # keep the pool busy without submitting every item at once
+                for item in queue:
+                    pending[executor.submit(call, func, item)] = item
+                    if len(pending) >= max_pending:
+                        break
+                if not pending:
+                    break
+                done, _ = wait(pending, return_when=FIRST_COMPLETED)
+                for future in done:
+                    yield pending.pop(future), *_result(future)
+                    bar.update(1)
+
+
+def echo_failures(failures: list[tuple[Any, str]], label: str = 'files') -> None:
+    """
+    Prints a summary of failed items to stderr
+
+    :param failures: list of (item, error message) tuples
+    :param label: name of the processed items
+    """
+    if not failures:
+        return
+    click.echo(f'{len(failures)} {label} failed:', err=True)
+    for item, error in failures:
+        click.echo(f'\t{item}: {error}', err=True)
@@ -0,0 +1 @@
+from .profiler import PROFILER, Profiler, count, stage
@@ -0,0 +1,117 @@
+import threading
+import time
+from collections import Counter
+from contextlib import nullcontext
+
+_DISABLED = nullcontext()
+
+
+class Stage:
+    __slots__ = ('_profiler', '_name', '_start')
+
+    def __init__(self, profiler: 'Profiler', name: str):
+        """ Context manager adding the time spent in its block to a stage of a profiler """
+        self._profiler = profiler
+        self._name = name
+        self._start = 0.0
+
+    def __enter__(self):
+        self._start = time.perf_counter()
+        return self
+
+    def __exit__(self, *args):
+        self._profiler.add_time(self._name, time.perf_counter() - self._start)
+
+
+class Profiler:
+    def __init__(self):
+        """
+        Collects per stage timings and counters. Disabled profilers cost a single attribute check per hook.
+        Timings of parallel workers are summed up, so stage times can exceed the wall time of a run.
+        """
+        self.enabled: bool = False
+        self.times: dict[str, float] = {}
+        self.calls: Counter = Counter()
+        self.counters: Counter = Counter()
+        self._lock = threading.Lock()
+
+    def stage(self, name: str):
+        """
+        Returns a context manager timing its block as stage name (parse, transform, serialize, io, ...)
+
+        :param name: stage name
+        :return: context manager
+        """
+        return Stage(self, name) if self.enabled else _DISABLED
+
+    def add_time(self, name: str, seconds: float) -> None:
+        """ Adds time of a single call to a stage """
+        with self._lock:
+            self.times[name] = self.times.get(name, 0.0) + seconds
+            self.calls[name] += 1
+
+    def count(self, name: str, n: int = 1) -> None:
+        """
+        Increases a counter (files, elements, vertices, ...), no-op if disabled
+
+        :param name: counter name
+        :param n: increment
+        :return: None
+        """
+        if self.enabled:
+            with self._lock:
+                self.counters[name] += n
+
+    def reset(self) -> None:
+        """ Removes all timings and counters """
+        with self._lock:
+            self.times.clear()
+            self.calls.clear()
+            self.counters.clear()
+
+    def snapshot(self) -> tuple[dict, dict, dict]:
+        """ Returns picklable copy of timings and counters, e.g. to send them from a worker process """
+        with self._lock:
+            return dict(self.times), dict(self.calls), dict(self.counters)
+
+    def merge(self, snapshot: tuple[dict, dict, dict]) -> None:
+        """ Adds timings and counters of a snapshot """
+        times, calls, counters = snapshot
+        with self._lock:
+            for name, seconds in times.items():
+                self.times[name] = self.times.get(name, 0.0) + seconds
+            self.calls.update(calls)
+            self.counters.update(counters)
+
+    def summary(self, wall: float | None = None) -> str:
+        """
+        Returns timings and counters as table
+
+        :param wall: wall time of the run in seconds, adds share of each stage
+        :return: table as string
+        """
+        lines = [f'{"stage":<12} {"calls":>9} {"total s":>10} {"mean ms":>10}' + (f' {"share":>7}' if wall else '')]
+        for name, seconds in sorted(self.times.items(), key=lambda x: -x[1]):
+            line = f'{name:<12} {self.calls[name]:>9} {seconds:>10.3f} {seconds / self.calls[name] * 1000:>10.3f}'
+            lines.append(line + (f' {seconds / wall:>6.1%}' if wall else ''))
+        if wall:
+            lines.append(f'{"wall":<12} {"":>9} {wall:>10.3f}')
+        if self.counters:
+            lines.append('')
+            lines.append(f'{"counter":<12} {"value":>9}' + (f' {"per s":>10}' if wall else ''))
+            for name, value in sorted(self.counters.items()):
+                lines.append(f'{name:<12} {value:>9}' + (f' {value / wall:>10.1f}' if wall else ''))
+        return '\n'.join(lines)
+
+
+PROFILER = Profiler()
+
+
+def stage(name: str):
+    """ Times a block as stage of the global profiler, see Profiler.stage """
+    return PROFILER.stage(name)
+
+
+def count(name: str, n: int = 1) -> None:
+    """ Increases a counter of the global profiler, see Profiler.count """
+    PROFILER.count(name, n)
@@ -0,0 +1 @@
+from .matcher import Matcher, AhoCorasick, RegexMatcher, compile_matcher
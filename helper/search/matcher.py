@@ -0,0 +1,126 @@
+import re
+import unicodedata
+from abc import ABC, abstractmethod
+from collections import deque
+
+import click
+
+
+class Matcher(ABC):
+    """
+    Base class of multi-pattern matchers. Patterns are compiled once, each text is scanned once.
+    Optionally, patterns and texts are Unicode normalized (NFC, NFD, NFKC, NFKD) and/or case-folded before matching.
+    """
+    def __init__(self, patterns: list[str], normalize: str | None = None, casefold: bool = False):
+        self.patterns: list[str] = patterns
+        self._normalize: str | None = normalize
+        self._casefold: bool = casefold
+
+    def _prepare(self, text: str) -> str:
+        """ Applies the configured normalization to a text """
+        if self._normalize is not None:
+            text = unicodedata.normalize(self._normalize, text)
+        if self._casefold:
+            text = text.casefold()
+        return text
+
+    def find(self, text: str) -> list[str]:
+        """ Returns all patterns found in text, in order of the pattern list """
+        return [self.patterns[i] for i in self.find_indices(text)]
+
+    @abstractmethod
+    def find_indices(self, text: str) -> list[int]:
+        """ Returns indices of all patterns found in text, sorted ascending """
+
+
+class AhoCorasick(Matcher):
+    """
+    Aho-Corasick automaton for plain substring search. Scanning a text costs O(len(text) + hits),
+    independent of the number of patterns.
+    """
+    def __init__(self, patterns: list[str], normalize: str | None = None, casefold: bool = False):
+        super().__init__(patterns, normalize, casefold)
+        self._goto: list[dict[str, int]] = [{}]  # transitions of each node
+        self._fail: list[int] = [0]  # failure link of each node
+        self._out: list[tuple[int, ...]] = [()]  # indices of patterns ending in each node
+        self.__build()
+
+    def __build(self) -> None:
+        """
+        Builds trie from patterns and computes failure links in breadth-first order
+
+        :return: None
+        """
+        out: list[list[int]] = [[]]
+        for index, pattern in enumerate(self.patterns):
+            pattern = self._prepare(pattern)
+            if not pattern:
+                continue
+            node = 0
+            for char in pattern:
+                if char not in self._goto[node]:
+                    self._goto.append({})
+                    self._fail.append(0)
+                    out.append([])
+                    self._goto[node][char] = len(self._goto) - 1
+                node = self._goto[node][char]
+            out[node].append(index)
+
+        queue = deque(self._goto[0].values())
+        while queue:
+            node = queue.popleft()
+            for char, child in self._goto[node].items():
+                queue.append(child)
+                fail = self._fail[node]
+                while fail and char not in self._goto[fail]:
+                    fail = self._fail[fail]
+                self._fail[child] = self._goto[fail].get(char, 0)
+                out[child].extend(out[self._fail[child]])  # inherit matches of the longest proper suffix
+        self._out = [tuple(o) for o in out]
+
+    def find_indices(self, text: str) -> list[int]:
+        goto, fail, out = self._goto, self._fail, self._out
+        found = set()
+        node = 0
+        for char in self._prepare(text):
+            while node and char not in goto[node]:
+                node = fail[node]
+            node = goto[node].get(char, 0)
+            if out[node]:
+                found.update(out[node])
+        return sorted(found)
+
+
+class RegexMatcher(Matcher):
+    """
+    Matches each pattern as regular expression. Case-folding is done with re.IGNORECASE.
+    """
+    def __init__(self, patterns: list[str], normalize: str | None = None, casefold: bool = False):
+        super().__init__(patterns, normalize, False)
+        flags = re.IGNORECASE if casefold else 0
+        self._regex: list[re.Pattern] = []
+        for p in patterns:
+            try:
+                self._regex.append(re.compile(self._prepare(p), flags))
+            except re.error as e:
+                raise click.BadParameter(f'Invalid regular expression {p!r}: {e}', param_hint="'SEARCH_FILE'")
+
+    def find_indices(self, text: str) -> list[int]:
+        text = self._prepare(text)
+        return [i for i, regex in enumerate(self._regex) if regex.search(text)]
+
+
+def compile_matcher(patterns: list[str], regex: bool = False, normalize: str | None = None,
+                    casefold: bool = False) -> Matcher:
+    """
+    Compiles a list of search patterns into a matcher
+
+    :param patterns: list of search strings
+    :param regex: treat patterns as regular expressions instead of plain strings
+    :param normalize: Unicode normalization form (NFC, NFD, NFKC, NFKD) applied to patterns and texts
+    :param casefold: case-insensitive matching
+    :return: matcher object
+    """
+    if regex:
+        return RegexMatcher(patterns, normalize, casefold)
+    return AhoCorasick(patterns, normalize, casefold)
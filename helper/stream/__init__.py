@@ -0,0 +1,2 @@
+from .textlines import iter_text_lines, iter_numbered_lines, number_lines, get_line_text
+from .jsonarrays import iter_json_arrays
@@ -0,0 +1,105 @@
+import json
+from pathlib import Path
+from typing import Any, Iterator
+
+WHITESPACE = ' \t\n\r'
+DELIMITERS = WHITESPACE + ',:]}'
+
+
+class _JsonReader:
+    def __init__(self, fp: Path | str, chunk_size: int):
+        """
+        Buffered reader for incremental decoding of a JSON file
+
+        :param fp: path to JSON file
+        :param chunk_size: number of characters read at once
+        """
+        self.__file = open(fp, 'r', encoding='utf-8')
+        self.__chunk_size = chunk_size
+        self.__decoder = json.JSONDecoder()
+        self.buffer = ''
+        self.pos = 0
+        self.eof = False
+
+    def close(self) -> None:
+        self.__file.close()
+
+    def read(self) -> bool:
+        """ Appends the next chunk to the buffer, drops consumed data. Returns False at end of file """
+        if self.eof:
+            return False
+        chunk = self.__file.read(self.__chunk_size)
+        if not chunk:
+            self.eof = True
+            return False
+        self.buffer = self.buffer[self.pos:] + chunk
+        self.pos = 0
+        return True
+
+    def peek(self) -> str:
+        """ Skips whitespace and returns next character (empty string at end of file) """
+        while True:
+            while self.pos < len(self.buffer) and self.buffer[self.pos] in WHITESPACE:
+                self.pos += 1
+            if self.pos < len(self.buffer) or not self.read():
+                return self.buffer[self.pos:self.pos + 1]
+
+    def expect(self, char: str) -> None:
+        """ Consumes the next non-whitespace character, which must be char """
+        if (found := self.peek()) != char:
+            raise ValueError(f'Invalid JSON: expected "{char}", found "{found}"')
+        self.pos += 1
+
+    def decode(self) -> Any:
+        """ Decodes the next JSON value, reads more data until the value is complete """
+        self.peek()
+        while True:
+            try:
+                value, end = self.__decoder.raw_decode(self.buffer, self.pos)
+            except json.JSONDecodeError:
+                if not self.read():
+                    raise
+                continue
+            # a number might continue in the next chunk (e.g. "12" of "12.5"), values end with a delimiter
+            if (end == len(self.buffer) or self.buffer[end] not in DELIMITERS) and self.read():
+                continue
+            self.pos = end
+            return value
+
+
+def iter_json_arrays(fp: Path | str, chunk_size: int = 1 << 20) -> Iterator[tuple[str, Any]]:
+    """
+    Streams through a JSON file with an object at top level, e.g. a COCO file.
+    Elements of top level arrays are decoded and yielded one by one, so memory usage depends on the size of a single
+    element, not on the file size. Other top level values are yielded as a whole.
+
+    :param fp: path to JSON file
+    :param chunk_size: number of characters read at once
+    :return: generator of (top level key, array element or value) tuples in file order
+    """
+    reader = _JsonReader(fp, chunk_size)
+    try:
+        reader.expect('{')
+        if reader.peek() == '}':
+            return
+        while True:
+            key = reader.decode()
+            reader.expect(':')
+            if reader.peek() == '[':
+                reader.pos += 1
+                if reader.peek() == ']':
+                    reader.pos += 1
+                else:
+                    while True:
+                        yield key, reader.decode()
+                        if reader.peek() == ']':
+                            reader.pos += 1
+                            break
+                        reader.expect(',')
+            else:
+                yield key, reader.decode()
+            if reader.peek() == '}':
+                return
+            reader.expect(',')
+    finally:
+        reader.close()
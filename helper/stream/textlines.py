@@ -0,0 +1,78 @@
+from pathlib import Path
+from typing import Iterable, Iterator
+
+from lxml import etree
+
+
+def get_line_text(text_line: etree.Element) -> str:
+    """
+    Extracts text from a TextLine element, returns empty string if nothing found.
+    Prefers the TextEquiv without index or with index 0, falls back to the first TextEquiv.
+
+    :param text_line: TextLine element
+    :return: text of the line
+    """
+    equiv = None
+    for child in text_line.iterchildren('{*}TextEquiv'):
+        if child.get('index') in (None, '0'):
+            equiv = child
+            break
+        if equiv is None:
+            equiv = child
+    if equiv is None:
+        return ''
+    unicode = next(equiv.iterchildren('{*}Unicode'), None)
+    if unicode is None or unicode.text is None:
+        return ''
+    return unicode.text
+
+
+def iter_text_lines(fp: Path | str) -> Iterator[tuple[str, str]]:
+    """
+    Streams through a PageXML file and yields the text of each TextLine together with the id of its TextRegion.
+    Processed elements are discarded, so memory usage does not depend on the file size.
+
+    :param fp: path to PageXML file
+    :return: generator of (region id, line text) tuples in document order
+    """
+    regions: list[str] = []  # stack of open (nested) TextRegion ids
+    for event, element in etree.iterparse(str(fp), events=('start', 'end'), tag=('{*}TextRegion', '{*}TextLine')):
+        if element.tag.endswith('TextRegion'):
+            if event == 'start':
+                regions.append(element.get('id', ''))
+                continue
+            regions.pop()
+        elif event == 'end':
+            yield regions[-1] if regions else '', get_line_text(element)
+        else:
+            continue
+        # discard finished element and already processed siblings
+        element.clear()
+        while element.getprevious() is not None:
+            del element.getparent()[0]
+
+
+def number_lines(lines: Iterable[tuple[str, str]]) -> Iterator[tuple[str, int, str]]:
+    """
+    Filters empty lines and numbers the others per TextRegion (starting with 0)
+
+    :param lines: (region id, line text) tuples in document order, see iter_text_lines
+    :return: generator of (region id, line number, line text) tuples in document order
+    """
+    line_counters: dict[str, int] = {}  # count lines in each region
+    for region_id, line_text in lines:
+        if line_text == '':  # filter empty lines
+            continue
+        line_counter = line_counters.get(region_id, 0)
+        yield region_id, line_counter, line_text
+        line_counters[region_id] = line_counter + 1
+
+
+def iter_numbered_lines(fp: Path | str) -> Iterator[tuple[str, int, str]]:
+    """
+    Streams through a PageXML file and yields all non-empty TextLines, numbered per TextRegion (starting with 0).
+
+    :param fp: path to PageXML file
+    :return: generator of (region id, line number, line text) tuples in document order
+    """
+    return number_lines(iter_text_lines(fp))
@@ -1,11 +1,44 @@
+import importlib
+import time
+
 import click
 
-from modules import (coco2page_cli, img2img_cli, pdf2img_cli, csv2txt_cli,
-                     pagefix_cli, rename_cli,
-                     pagestats_cli, pagesearch_cli)
+from modules import COMMANDS
+
+
+class LazyGroup(click.Group):
+    """
+    Click group, which imports the module of a subcommand only when the subcommand is invoked.
+    Help pages list the stored short help, so that no subcommand (and none of its dependencies) is imported.
+    """
+    def __init__(self, *args, lazy_commands: dict[str, tuple[str, str, str]] | None = None, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.lazy_commands: dict[str, tuple[str, str, str]] = lazy_commands or {}
+
+    def list_commands(self, ctx: click.Context) -> list[str]:
+        return sorted(set(super().list_commands(ctx)) | set(self.lazy_commands))
+
+    def get_command(self, ctx: click.Context, cmd_name: str) -> click.Command | None:
+        if cmd_name in self.lazy_commands and cmd_name not in self.commands:
+            module, name, _ = self.lazy_commands[cmd_name]
+            self.add_command(getattr(importlib.import_module(module), name), cmd_name)
+        return super().get_command(ctx, cmd_name)
+
+    def format_commands(self, ctx: click.Context, formatter: click.HelpFormatter) -> None:
+        rows = []
+        for cmd_name in self.list_commands(ctx):
+            if cmd_name in self.commands:
+                cmd = self.commands[cmd_name]
+                if not cmd.hidden:
+                    rows.append((cmd_name, cmd.get_short_help_str(formatter.width - 6 - len(cmd_name))))
+            else:
+                rows.append((cmd_name, self.lazy_commands[cmd_name][2]))
+        if rows:
+            with formatter.section('Commands'):
+                formatter.write_dl(rows)
 
 
-@click.group()
+@click.group(cls=LazyGroup, lazy_commands=COMMANDS)
 @click.help_option("--help", "-h")
 @click.version_option(
     "3.0",
@@ -13,27 +46,46 @@ from modules import (coco2page_cli, img2img_cli, pdf2img_cli, csv2txt_cli,
     prog_name="HTRtools",
     message="%(prog)s v%(version)s - Developed at Centre for Philology and Digitality (ZPD), University of Würzburg"
 )
-def cli(**kwargs):
+@click.option(
+    "--profile",
+    help="Print timings of processing stages (parse, transform, serialize, io) and counters at the end of the run.",
+    is_flag=True,
+    default=False
+)
+@click.option(
+    "--profile-dump",
+    help="Write cProfile statistics of the main process to a pstats file (implies --profile).",
+    type=click.Path(exists=False, dir_okay=False, file_okay=True),
+    required=False
+)
+@click.pass_context
+def cli(ctx: click.Context, profile: bool, profile_dump: str | None):
     """
     HTRtools main entry point.
 
     Developed at Centre for Philology and Digitality (ZPD), University of Würzburg.
     """
+    if profile or profile_dump:
+        from helper.profiling import PROFILER
 
+        PROFILER.enabled = True
+        start = time.perf_counter()
+        profiler = None
+        if profile_dump:
+            import cProfile
 
-# analyse module
-cli.add_command(pagestats_cli)
-cli.add_command(pagesearch_cli)
+            profiler = cProfile.Profile()
+            profiler.enable()
 
-# manipulation module
-cli.add_command(rename_cli)
-cli.add_command(pagefix_cli)
+        def summary():
+            if profiler is not None:
+                profiler.disable()
+                profiler.dump_stats(profile_dump)
+            click.echo(f'\n{PROFILER.summary(time.perf_counter() - start)}', err=True)
+            if profiler is not None:
+                click.echo(f'cProfile statistics written to {profile_dump} (main process only)', err=True)
 
-# parser module
-cli.add_command(coco2page_cli)
-cli.add_command(csv2txt_cli)
-cli.add_command(img2img_cli)
-cli.add_command(pdf2img_cli)
+        ctx.call_on_close(summary)
 
 
 if __name__ == '__main__':
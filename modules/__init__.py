@@ -1,10 +1,35 @@
-from .parser.coco2page import coco2page_cli
-from .parser.img2img import img2img_cli
-from .parser.pdf2img import pdf2img_cli
-from .parser.csv2txt import csv2txt_cli
+# Subcommands: name -> (module, command object, short help).
+# Modules are imported when their subcommand runs, help pages only need the short help.
+COMMANDS: dict[str, tuple[str, str, str]] = {
+    # analyse module
+    'pagestats': ('modules.analyse.pagestats', 'pagestats_cli',
+                  'Outputs stats of PageXML files.'),
+    'pagesearch': ('modules.analyse.pagesearch', 'pagesearch_cli',
+                   'Search for characters in set of PageXML files.'),
+    'pageindex': ('modules.analyse.pageindex', 'pageindex_cli',
+                  'Build and query a full-text index of PageXML files.'),
 
-from .manipulation.pagefix import pagefix_cli
-from .manipulation.rename import rename_cli
+    # manipulation module
+    'rename': ('modules.manipulation.rename', 'rename_cli',
+               'Rename a set of files.'),
+    'pagefix': ('modules.manipulation.pagefix', 'pagefix_cli',
+                'Fix invalid PageXML documents.'),
 
-from .analyse.pagestats import pagestats_cli
-from .analyse.pagesearch import pagesearch_cli
+    # parser module
+    'coco2page': ('modules.parser.coco2page', 'coco2page_cli',
+                  'Converts COCO annotations to PageXML files.'),
+    'csv2txt': ('modules.parser.csv2txt', 'csv2txt_cli',
+                'Extracts columns from a CSV file into TXT files.'),
+    'img2img': ('modules.parser.img2img', 'img2img_cli',
+                'Convert image files.'),
+    'pdf2img': ('modules.parser.pdf2img', 'pdf2img_cli',
+                'Convert PDF file to image files.'),
+
+    # pipeline module
+    'pipeline': ('modules.pipeline.pipeline', 'pipeline_cli',
+                 'Run subcommands as stages of a single pipeline.'),
+
+    # benchmark module
+    'bench': ('modules.benchmark.bench', 'bench_cli',
+              'Benchmark subcommands on a synthetic corpus.'),
+}
@@ -0,0 +1,256 @@
+import sqlite3
+from pathlib import Path
+
+import click
+from lxml import etree
+
+from helper.cache import file_hash
+from helper.profiling import count, stage
+from helper.stream import iter_numbered_lines
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS files (
+    id INTEGER PRIMARY KEY,
+    path TEXT UNIQUE NOT NULL,
+    mtime INTEGER NOT NULL,
+    size INTEGER NOT NULL,
+    hash TEXT NOT NULL
+);
+CREATE TABLE IF NOT EXISTS lines (
+    id INTEGER PRIMARY KEY,
+    file_id INTEGER NOT NULL REFERENCES files(id),
+    pos INTEGER NOT NULL,
+    region TEXT NOT NULL,
+    line INTEGER NOT NULL,
+    text TEXT NOT NULL
+);
+CREATE INDEX IF NOT EXISTS lines_file ON lines(file_id);
+CREATE VIRTUAL TABLE IF NOT EXISTS lines_fts USING fts5(
+    text, content='lines', content_rowid='id', tokenize='trigram case_sensitive 1'
+);
+CREATE TRIGGER IF NOT EXISTS lines_ai AFTER INSERT ON lines BEGIN
+    INSERT INTO lines_fts(rowid, text) VALUES (new.id, new.text);
+END;
+CREATE TRIGGER IF NOT EXISTS lines_ad AFTER DELETE ON lines BEGIN
+    INSERT INTO lines_fts(lines_fts, rowid, text) VALUES ('delete', old.id, old.text);
+END;
+"""
+
+
+def escape_glob(pattern: str) -> str:
+    """ Escapes GLOB wildcards, so that the pattern is matched literally """
+    return ''.join(f'[{c}]' if c in '*?[' else c for c in pattern)
+
+
+class PageIndex:
+    def __init__(self, index_fp: Path) -> None:
+        """
+        Opens (or creates) a full-text index of TextLines in a set of PageXML files.
+        Stores text, file, region id and line number of each non-empty line in a SQLite FTS5 database.
+
+        :param index_fp: path to index database
+        """
+        self.__con = sqlite3.connect(index_fp.as_posix())
+        self.__con.executescript(SCHEMA)
+
+    def close(self) -> None:
+        """
+        Closes the index database
+
+        :return: None
+        """
+        self.__con.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+    def __insert_file(self, fp: Path, mtime: int, size: int, digest: str) -> None:
+        """
+        (Re-)indexes all lines of a single file
+
+        :param fp: path to PageXML file
+        :param mtime: modification time in nanoseconds
+        :param size: file size in bytes
+        :param digest: sha1 digest of the file content
+        :return: None
+        """
+        with stage('parse'):
+            lines = list(iter_numbered_lines(fp))  # parse before touching the index, file might be invalid
+        count('files')
+        count('lines', len(lines))
+        with stage('io'):
+            self.__write_file(fp, mtime, size, digest, lines)
+
+    def __write_file(self, fp: Path, mtime: int, size: int, digest: str, lines: list[tuple]) -> None:
+        """
+        Replaces a file and its lines in the index
+
+        :param fp: path to PageXML file
+        :param mtime: modification time in nanoseconds
+        :param size: file size in bytes
+        :param digest: sha1 digest of the file content
+        :param lines: (region, line number, text) tuples
+        :return: None
+        """
+        cur = self.__con.cursor()
+        row = cur.execute('SELECT id FROM files WHERE path = ?', (fp.as_posix(),)).fetchone()
+        if row is not None:
+            cur.execute('DELETE FROM lines WHERE file_id = ?', row)
+            cur.execute('DELETE FROM files WHERE id = ?', row)
+        cur.execute('INSERT INTO files(path, mtime, size, hash) VALUES (?, ?, ?, ?)',
+                    (fp.as_posix(), mtime, size, digest))
+        file_id = cur.lastrowid
+        cur.executemany(
+            'INSERT INTO lines(file_id, pos, region, line, text) VALUES (?, ?, ?, ?, ?)',
+            ((file_id, pos, region, line, text) for pos, (region, line, text) in enumerate(lines))
+        )
+
+    def update(self, files: list[Path | str]) -> tuple[int, int]:
+        """
+        Incrementally updates the index to the given set of files. Files are only re-parsed if their modification
+        time or size changed and their content hash differs. Indexed files not in the list are removed.
+
+        :param files: list of PageXML files
+        :return: number of (re-)indexed files, number of removed files
+        """
+        indexed = {path: (mtime, size, digest) for path, mtime, size, digest in
+                   self.__con.execute('SELECT path, mtime, size, hash FROM files')}
+        files = [Path(fp) for fp in files]
+        updated = 0
+        with self.__con:
+            with click.progressbar(files, label='Updating index', show_pos=True, show_eta=True,
+                                   show_percent=True) as fps:
+                for fp in fps:
+                    stat = fp.stat()
+                    known = indexed.pop(fp.as_posix(), None)
+                    if known is not None and known[:2] == (stat.st_mtime_ns, stat.st_size):
+                        continue
+                    with stage('hash'):
+                        digest = file_hash(fp)
+                    if known is not None and known[2] == digest:
+                        self.__con.execute('UPDATE files SET mtime = ?, size = ? WHERE path = ?',
+                                           (stat.st_mtime_ns, stat.st_size, fp.as_posix()))
+                        continue
+                    try:
+                        self.__insert_file(fp, stat.st_mtime_ns, stat.st_size, digest)
+                        updated += 1
+                    except etree.XMLSyntaxError as e:
+                        click.echo(f'InvalidXML (skip): {fp} ({e})', err=True)
+            for path in indexed:  # files which no longer exist
+                row = self.__con.execute('SELECT id FROM files WHERE path = ?', (path,)).fetchone()
+                self.__con.execute('DELETE FROM lines WHERE file_id = ?', row)
+                self.__con.execute('DELETE FROM files WHERE id = ?', row)
+        return updated, len(indexed)
+
+    def search(self, search: list[str]) -> dict[str, list[dict]]:
+        """
+        Searches index for lines containing any of the search strings (case-sensitive substring search)
+
+        :param search: list of search strings
+        :return: dictionary with file path as key and list of hits (in document order) as value
+        """
+        found: dict[str, list[tuple]] = {}
+        for index, s in enumerate(search):
+            if len(s) < 3:  # too short for trigram lookup, scan lines instead
+                query = ('SELECT files.path, lines.pos, lines.region, lines.line, lines.text FROM lines '
+                         'JOIN files ON files.id = lines.file_id WHERE instr(lines.text, ?) > 0')
+                args = (s,)
+            else:
+                query = ('SELECT files.path, lines.pos, lines.region, lines.line, lines.text FROM lines_fts '
+                         'JOIN lines ON lines.id = lines_fts.rowid JOIN files ON files.id = lines.file_id '
+                         'WHERE lines_fts.text GLOB ?')
+                args = (f'*{escape_glob(s)}*',)
+            for path, pos, region, line, text in self.__con.execute(query, args):
+                found.setdefault(path, []).append((pos, index, region, line, text))
+        result = {}
+        for path in sorted(found):
+            result[path] = [{
+                'line': line,
+                'region': region.replace('r', ''),
+                'text': text,
+                'search': search[index],
+            } for pos, index, region, line, text in sorted(found[path])]
+        return result
+
+
+@click.group('pageindex', short_help='Build and query a full-text index of PageXML files.')
+@click.help_option('--help', '-h')
+def pageindex_cli():
+    """
+    Build and query a persistent full-text index of TextLines in a set of PageXML files.
+    """
+
+
+@pageindex_cli.command('build', short_help='Create or update an index.')
+@click.help_option('--help', '-h')
+@click.argument(
+    'input_dir',
+    type=click.Path(exists=True, dir_okay=True, file_okay=False),
+    required=True,
+)
+@click.argument(
+    'index',
+    type=click.Path(exists=False, dir_okay=False, file_okay=True),
+    required=True,
+)
+@click.option(
+    '-r', '--recursive',
+    help='Recursive search in input directory.',
+    is_flag=True,
+    type=bool,
+    default=False
+)
+@click.option(
+    '--config',
+    help='Use custom config.cfg file (file selection only).',
+    type=click.Path(exists=True, dir_okay=False, file_okay=True),
+    required=False
+)
+def pageindex_build_cli(input_dir: str, index: str, recursive: bool, config: str | None):
+    """
+    Creates INDEX for PageXML files in INPUT_DIR or updates it incrementally.
+
+    Files are selected like in pagesearch. Only new or changed files are parsed.
+    """
+    from .pagesearch import PageSearch, DEFAULT_CONFIG
+
+    files = PageSearch(
+        input_dir=Path(input_dir).absolute(),
+        recursive=recursive,
+        config=DEFAULT_CONFIG if config is None else Path(config).absolute()
+    ).files
+    with PageIndex(Path(index)) as pi:
+        updated, removed = pi.update(files)
+    click.echo(f'Done! ({updated} indexed, {removed} removed)')
+
+
+@pageindex_cli.command('search', short_help='Search an index.')
+@click.help_option('--help', '-h')
+@click.argument(
+    'index',
+    type=click.Path(exists=True, dir_okay=False, file_okay=True),
+    required=True,
+)
+@click.argument(
+    'search_file',
+    type=click.Path(exists=True, dir_okay=False, file_okay=True),
+    required=True,
+)
+def pageindex_search_cli(index: str, search_file: str):
+    """
+    Searches INDEX for character sequences in SEARCH_FILE and prints results to console.
+    """
+    from .pagesearch import parse_search
+
+    search = parse_search(Path(search_file))
+    with PageIndex(Path(index)) as pi:
+        result = pi.search(search)
+    if not result:
+        click.echo('Nothing found!')
+    for path, hits in result.items():
+        click.echo(path)
+        for hit in hits:
+            click.echo(f'\tFound {hit["search"]} in line {hit["line"]}: "{hit["text"]}"')
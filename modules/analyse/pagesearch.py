@@ -1,26 +1,98 @@
 import csv
-import os
-import bs4
-import shutil
 import configparser
+import os
+from concurrent.futures import ThreadPoolExecutor, FIRST_COMPLETED, Future, wait
 from pathlib import Path
 from glob import glob
+from typing import Iterable, Iterator
 
 import click
 from lxml import etree
 
-DEFAULT_CONFIG = Path(__file__).parent.parent.parent.joinpath('config', 'pagesearch.cfg')
+from helper.files import COPY_MODES, copy_file
+from helper.parallel import parallel_map, echo_failures
+from helper.profiling import count, stage
+from helper.search import Matcher, compile_matcher
+from helper.stream import iter_numbered_lines
+from .pageindex import PageIndex
+
+DEFAULT_CONFIG = Path(__file__).parent.parent.parent.joinpath('configs', 'pagesearch.cfg')
 CSV_HEADER = ['search', 'out_file', 'line', 'text', 'original_file']
 CSV_FILE = 'results.csv'
 
 
+def parse_search(fp: Path) -> list[str]:
+    """
+    parse search file and returns list of char sequences
+
+    :param fp: path to file
+    :return: list of file content
+    """
+    with open(fp.as_posix(), 'r', encoding='utf-8') as f:
+        data = f.readlines()
+    return [x.strip() for x in data if x.strip() != '' and not x.startswith('#')]
+
+
+def match_lines(lines: Iterable[tuple[str, int, str]], matcher: Matcher) -> list[dict]:
+    """
+    Matches numbered text lines of a single file
+
+    :param lines: (region id, line number, line text) tuples, see iter_numbered_lines
+    :param matcher: compiled search strings
+    :return: list of hits in document order
+    """
+    hits = []
+    lines_count = 0
+    for region_id, line_counter, line_text in lines:
+        lines_count += 1
+        for s in matcher.find(line_text):  # all search symbols in line
+            hits.append({
+                'line': line_counter,
+                'region': region_id.replace('r', ''),
+                'text': line_text,
+                'search': s,
+            })
+    count('lines', lines_count)
+    count('hits', len(hits))
+    return hits
+
+
+def match_file(fp: str | Path, matcher: Matcher) -> list[dict]:
+    """
+    Parses a single file and matches each line
+
+    :param fp: path to PageXML file
+    :param matcher: compiled search strings
+    :return: list of hits in document order
+    """
+    with stage('search'):  # parsing and matching are interleaved
+        hits = match_lines(iter_numbered_lines(fp), matcher)
+    count('files')
+    return hits
+
+
+_worker_matcher: Matcher | None = None  # matcher of a worker process, see init_worker
+
+
+def init_worker(matcher: Matcher) -> None:
+    """ Installs the matcher of a worker process, so it is pickled once per worker instead of once per file """
+    global _worker_matcher
+    _worker_matcher = matcher
+
+
+def match_worker(fp: str | Path) -> list[dict]:
+    """ Parses a single file and matches each line with the matcher installed by init_worker """
+    return match_file(fp, _worker_matcher)
+
+
 class PageSearch:
     def __init__(
             self,
             input_dir: Path,
             output_dir: Path = None,
             recursive: bool = True,
-            config: Path = DEFAULT_CONFIG
+            config: Path = DEFAULT_CONFIG,
+            copy_mode: str | None = None
     ) -> None:
         """
         Loads all .xml files from a folder based on arguments and makes them searchable
@@ -29,6 +101,7 @@ class PageSearch:
         :param output_dir: output directory (will be created if not existent)
         :param recursive: search all folders recursively
         :param config: change default config file path
+        :param copy_mode: copy, hardlink or reflink, overrides config file
         """
         self.__input_dir: Path = input_dir
         self.__output_dir: Path = output_dir
@@ -38,9 +111,13 @@ class PageSearch:
         self.__xml_config = ''
         self.__copy_config = []
         self.__xml_update = ''
+        self.__copy_mode = 'copy'
+        self.__copy_threads = 4
         self.__ex_files = []
         self.__ex_folders = []
         self.__load_config()
+        if copy_mode is not None:
+            self.__copy_mode = copy_mode
 
         self.files: list[Path] = []
         self.__load_files()
@@ -55,10 +132,14 @@ class PageSearch:
             'list': lambda x: [i.strip() for i in x.splitlines() if i != ''],
             'map': lambda x: [i.replace(' ', '').split('>') for i in x.splitlines() if i != ''],
         })
-        cfg.read(DEFAULT_CONFIG.as_posix())
+        cfg.read(self.__config.as_posix())
         self.__xml_config = cfg.get('EXTENSIONS', 'xml')
         self.__copy_config = cfg.getmap('EXTENSIONS', 'copy')
         self.__xml_update = cfg.get('EXTENSIONS', 'xml_update')
+        self.__copy_mode = cfg.get('COPY', 'mode', fallback='copy')
+        self.__copy_threads = cfg.getint('COPY', 'threads', fallback=4)
+        if self.__copy_mode not in COPY_MODES:
+            raise ValueError(f'Invalid copy mode in {self.__config}: {self.__copy_mode}')
         self.__ex_files = cfg.getlist('EXCLUDED', 'files')
         self.__ex_folders = cfg.getlist('EXCLUDED', 'folders')
 
@@ -77,129 +158,146 @@ class PageSearch:
         self.files.sort()
 
     @staticmethod
-    def __parse_search(fp: Path) -> list[str]:
-        """
-        parse search file and returns list of char sequences
-
-        :param fp: path to file
-        :return: list of file content
-        """
-        with open(fp.as_posix(), 'r', encoding='utf-8') as f:
-            data = f.readlines()
-        return [x.strip() for x in data if x.strip() != '' and not x.startswith('#')]
-
-    @staticmethod
-    def __get_line_text(text_line: bs4.PageElement) -> str:
+    def __print_results(results: Iterable[tuple[str, list[dict]]]) -> bool:
         """
-        extracts text from a TextLine elements, returns empty string if nothing found
+        Prints results of search in readable format, as soon as they are found
 
-        :param text_line:
-        :return:
+        :param results: (file path, hits) pairs from search methods
+        :return: True if anything was found
         """
-        equiv = text_line.find_all('TextEquiv', recursive=False)
-        if not equiv:
-            return ''
-        for index_line in equiv:
-            if 'index' not in index_line:
-                line = index_line.find('Unicode')
-                if line is None:
-                    return ''
-                return line.text
-            else:
-                if index_line['index'] == 0:
-                    line = index_line.find('Unicode')
-                    if line is None:
-                        return ''
-                    return line.text
-        return ''
+        found = False
+        for key, val in results:
+            found = True
+            click.echo(key)
+            for hits in val:
+                click.echo(f'\tFound {hits["search"]} in line {hits["line"]}: "{hits["text"]}"')
+        return found
 
     @staticmethod
-    def __print_results(results: dict) -> None:
+    def __fix_xml(orig_path: Path, xml_path: Path, filename: str) -> None:
         """
-        Prints results of search in readable format
+        Writes a copy of a pageXML file with changed imageFilename. The copy is written to a temporary file and
+        renamed, so an existing xml_path hardlinked to the original file (earlier hardlink runs) is replaced
+        instead of overwritten.
 
-        :param results: results dictionary from search method
+        :param orig_path: path to original xml file
+        :param xml_path: path to new xml file
+        :param filename: new filename
         :return: None
         """
-        for key, val in results.items():
-            click.echo(key)
-            for hits in val:
-                click.echo(f'\tFound {hits["search"]} in line {hits["line"]}: "{hits["text"]}"')
+        try:
+            with stage('io'):
+                root = etree.parse(orig_path).getroot()
+                page = root.find(".//{*}Page")
+                page.set('imageFilename', filename)
+                tmp_path = xml_path.with_name(f'.{xml_path.name}.tmp')
+                try:
+                    with open(tmp_path, "w", encoding='utf-8') as outfile:
+                        outfile.write(etree.tostring(root, encoding="unicode", pretty_print=True))
+                    os.replace(tmp_path, xml_path)
+                finally:
+                    tmp_path.unlink(missing_ok=True)
+        except Exception as e:
+            click.echo(e, err=True)
+            copy_file(orig_path, xml_path)
 
-    def __write_csv(self, content: list[list]) -> Path:
+    def __copy_jobs(self, orig_xml_path: Path, orig_name: str, fc: int) -> Iterator[tuple]:
         """
-        Writes a nested list to a csv file, name specified in global variables
+        Generates copy operations specified in config.cfg for a single result file
 
-        :param content: nested list of data
-        :return: path to csv file
+        :param orig_xml_path: path to original xml file
+        :param orig_name: file name without xml file extension
+        :param fc: file counter, used as new file name
+        :return: generator of (function, *arguments) tuples
         """
-        fp = Path(self.__output_dir.joinpath(CSV_FILE))
-        with open(fp.as_posix(), 'w', encoding='utf-8', newline='') as f:
-            stream = csv.writer(f)
-            stream.writerow(CSV_HEADER)
-            stream.writerows(content)
-        return fp
+        for orig_ext, new_ext in self.__copy_config:
+            orig_path = orig_xml_path.parent.joinpath(f'{orig_name}{orig_ext}')
+            new_path = self.__output_dir.joinpath(f'{fc:05d}{new_ext}')
+            if not orig_path.exists():
+                click.echo(f'FileNotFound (skip): {orig_path.as_posix()} > {new_path.as_posix()}')
+            elif orig_ext == self.__xml_config and self.__xml_update:  # update xml if needed
+                yield self.__fix_xml, orig_path, new_path, f'{fc:05d}{self.__xml_update}'
+            else:
+                yield copy_file, orig_path, new_path, self.__copy_mode
 
     @staticmethod
-    def __fix_xml(xml_path: Path, filename: str) -> None:
+    def __run_copy_jobs(jobs: list[tuple]) -> list[tuple[str, str]]:
         """
-        Tries to change imageFilename in pageXML file
+        Runs the copy operations of a single result file one after another, in order of config.cfg.
+        Several operations may write to the same file (e.g. two image extensions mapped to .png), the last one wins.
 
-        :param xml_path: path to xml file
-        :param filename: new filename
-        :return: None
+        :param jobs: (function, *arguments) tuples from __copy_jobs
+        :return: list of (file name, error message) tuples of failed operations
         """
-        root = etree.parse(xml_path).getroot()
-        if root is None:
-            return
-        try:
-            page = root.find(".//{*}Page")
-            page.set('imageFilename', filename)
-            with open(xml_path, "w", encoding='utf-8') as outfile:
-                outfile.write(etree.tostring(root, encoding="unicode", pretty_print=True))
-        except Exception as e:
-            click.echo(e, err=True)
-
-    def __copy_results(self, results: dict) -> Path:
+        failures = []
+        for func, *args in jobs:
+            try:
+                func(*args)
+            except Exception as e:
+                failures.append((args[0].name, f'{type(e).__name__}: {e}'))
+        return failures
+
+    def __write_results(self, results: Iterable[tuple[str, list[dict]]]) -> Path | None:
         """
-        Copy and rename files specified in config.cfg to output folder and creates results.csv in output folder
+        Writes hits to results.csv in output folder as soon as they are found and copies (renamed) files
+        specified in config.cfg to output folder in a thread pool, one task per result file
 
-        :param results: results dictionary from search method
-        :return: path to results.csv file
+        :param results: (file path, hits) pairs from search methods
+        :return: path to results.csv file, None if nothing was found
         """
-        if not self.__output_dir.exists():
-            os.mkdir(self.__output_dir)
-
-        csv_content = []
-        fc = 1  # file counter
-        for path, hits in results.items():
-            orig_xml_path = Path(path)
-            orig_name = orig_xml_path.name.replace(self.__xml_config, '')  # removes xml file extension
-            for ext_index in range(len(self.__copy_config)):
-                # generate paths and filenames
-                orig_path = orig_xml_path.parent.joinpath(f'{orig_name}{self.__copy_config[ext_index][0]}')
-                new_path = self.__output_dir.joinpath(f'{fc:05d}{self.__copy_config[ext_index][1]}')
-                if orig_path.exists():
-                    shutil.copy(orig_path, new_path)
-                    # update xml if needed
-                    if self.__copy_config[ext_index][0] == self.__xml_config and self.__xml_update:
-                        self.__fix_xml(new_path, f'{fc:05d}{self.__xml_update}')
+        fp = self.__output_dir.joinpath(CSV_FILE)
+        f = None
+        failures = []
+
+        def collect(futures: set[Future]) -> None:
+            for future in futures:
+                name = pending.pop(future)
+                if (e := future.exception()) is not None:
+                    failures.append((name, f'{type(e).__name__}: {e}'))
                 else:
-                    click.echo(f'FileNotFound (skip): {orig_path.as_posix()} > {new_path.as_posix()}')
-            # prepare data for csv file
-            for hit in hits:
-                csv_content.append([
-                    hit['search'],
-                    f'{fc:05d}',
-                    hit['line'],
-                    # hit['region'],
-                    hit['text'],
-                    orig_xml_path.parent.relative_to(self.__input_dir).joinpath(orig_name).as_posix()
-                ])
-            fc += 1
-        return self.__write_csv(csv_content)
-
-    def search(self, search_fp: Path, console: bool = False) -> None:
+                    failures.extend(future.result())
+
+        with ThreadPoolExecutor(max_workers=self.__copy_threads) as executor:
+            pending: dict[Future, str] = {}
+            try:
+                for fc, (path, hits) in enumerate(results, start=1):  # file counter
+                    if f is None:
+                        self.__output_dir.mkdir(parents=True, exist_ok=True)
+                        f = open(fp.as_posix(), 'w', encoding='utf-8', newline='')
+                        stream = csv.writer(f)
+                        stream.writerow(CSV_HEADER)
+                    orig_xml_path = Path(path)
+                    orig_name = orig_xml_path.name.replace(self.__xml_config, '')  # removes xml file extension
+                    # jobs of one result can share a destination, they run in a single task
+                    jobs = list(self.__copy_jobs(orig_xml_path, orig_name, fc))
+                    pending[executor.submit(self.__run_copy_jobs, jobs)] = orig_xml_path.name
+                    if len(pending) >= 4 * self.__copy_threads:
+                        collect(wait(pending, return_when=FIRST_COMPLETED).done)
+                    stream.writerows([
+                        hit['search'],
+                        f'{fc:05d}',
+                        hit['line'],
+                        # hit['region'],
+                        hit['text'],
+                        orig_xml_path.parent.relative_to(self.__input_dir).joinpath(orig_name).as_posix()
+                    ] for hit in hits)
+                collect(wait(pending).done)
+            finally:
+                if f is not None:
+                    f.close()
+        echo_failures(failures)
+        return None if f is None else fp
+
+    def search(
+            self,
+            search_fp: Path,
+            console: bool = False,
+            regex: bool = False,
+            normalize: str | None = None,
+            casefold: bool = False,
+            index: Path | None = None,
+            jobs: int = 1
+    ) -> None:
         """
         searches for char sequences from search text file and outputs results in csv file in output folder.
         copies affected files to output folder (numerated file names) if specified in config.cfg.
@@ -207,9 +305,14 @@ class PageSearch:
 
         :param search_fp: path to search text file
         :param console: output results only on console
+        :param regex: treat lines of search file as regular expressions
+        :param normalize: Unicode normalization form (NFC, NFD, NFKC, NFKD) applied before matching
+        :param casefold: case-insensitive search
+        :param index: path to a pageindex database, updated incrementally and used instead of parsing all files
+        :param jobs: number of worker processes parsing files (ignored with index)
         :return: None
         """
-        search = self.__parse_search(search_fp)
+        search = parse_search(search_fp)
         if not search:
             click.echo('Search empty!')
             return
@@ -218,41 +321,53 @@ class PageSearch:
             click.echo('No output directory set!')
             return
 
-        result: dict = {}  # key: file path, value: list of found data
-        for fp in self.files:
-            with open(fp, 'r', encoding='utf-8') as f:
-                stream = f.read()
-                bs = bs4.BeautifulSoup(stream, 'xml')
-            for iter_area in bs.find_all('TextRegion'):
-                line_counter = 0  # count lines in file
-                for iter_line in iter_area.find_all('TextLine'):
-                    # line_id = iter_line['id'].replace('l', '')
-                    line_text = self.__get_line_text(iter_line)
-                    if line_text == '':  # filter empty lines
-                        continue
-                    for s in search:
-                        # check for any search symbol in line
-                        if s in line_text:
-                            if fp not in result:
-                                result[fp] = []
-                            result[fp].append({
-                                'line': line_counter,
-                                'region': iter_area['id'].replace('r', ''),
-                                'text': line_text,
-                                'search': s,
-                            })
-                    line_counter += 1
-
-        if result:
-            if console:
-                self.__print_results(result)
-            else:
-                csv_file = self.__copy_results(result)
-                click.echo(f'Done! ({csv_file})')
+        if index is not None:
+            if regex or normalize or casefold:
+                click.echo('Index search only supports plain search strings!', err=True)
+                return
+            with PageIndex(index) as pi:
+                pi.update(self.files)
+                results = iter(pi.search(search).items())
+        else:
+            matcher = compile_matcher(search, regex=regex, normalize=normalize, casefold=casefold)
+            results = self.__search_files(matcher, jobs)
+
+        if console:
+            if not self.__print_results(results):
+                click.echo('Nothing found!')
+        elif (csv_file := self.__write_results(results)) is not None:
+            click.echo(f'Done! ({csv_file})')
         else:
             click.echo('Nothing found!')
+
+    def __search_files(self, matcher: Matcher, jobs: int = 1) -> Iterator[tuple[str, list[dict]]]:
+        """
+        Parses all files and matches each line, in worker processes if jobs > 1.
+        Results are always in order of files, so output file numbering does not depend on the number of jobs.
+
+        :param matcher: compiled search strings
+        :param jobs: number of worker processes
+        :return: generator of (file path, list of hits) pairs for files with hits, in order of files
+        """
+        if jobs > 1:
+            for fp, hits, error in parallel_map(match_worker, self.files, jobs=jobs, label='Searching', ordered=True,
+                                                initializer=init_worker, initargs=(matcher,)):
+                if error is not None:
+                    kind = 'InvalidXML' if error.startswith('XMLSyntaxError') else 'Error'
+                    click.echo(f'{kind} (skip): {fp} ({error})', err=True)
+                elif hits:
+                    yield fp, hits
             return
 
+        for fp in self.files:
+            try:
+                hits = match_file(fp, matcher)
+            except etree.XMLSyntaxError as e:
+                click.echo(f'InvalidXML (skip): {fp} ({e})', err=True)
+                continue
+            if hits:
+                yield fp, hits
+
 
 @click.command('pagesearch', short_help='Search for characters in set of PageXML files.')
 @click.help_option('--help', '-h')
@@ -294,7 +409,49 @@ class PageSearch:
     show_default=True,
     required=False
 )
-def pagesearch_cli(input_dir: str, search_file: str, console: bool, recursive: bool, output: str, config: str):
+@click.option(
+    '-e', '--regex',
+    help='Treat lines of SEARCH_FILE as regular expressions.',
+    is_flag=True,
+    type=bool,
+    default=False
+)
+@click.option(
+    '-n', '--normalize',
+    help='Unicode normalization applied to search strings and text lines before matching.',
+    type=click.Choice(['NFC', 'NFD', 'NFKC', 'NFKD'], case_sensitive=False),
+    required=False
+)
+@click.option(
+    '-i', '--ignore-case', 'casefold',
+    help='Case-insensitive search (Unicode case folding).',
+    is_flag=True,
+    type=bool,
+    default=False
+)
+@click.option(
+    '-x', '--index',
+    help='Use (and incrementally update) a pageindex database instead of parsing all files.',
+    type=click.Path(exists=False, dir_okay=False, file_okay=True),
+    required=False
+)
+@click.option(
+    '-m', '--copy-mode',
+    help='How result files are copied to the output directory. Hardlinks and reflinks fall back to copies '
+         'across filesystems. Overrides config file.',
+    type=click.Choice(COPY_MODES),
+    required=False
+)
+@click.option(
+    '-j', '--jobs',
+    help='Number of worker processes parsing files. Ignored if -x/--index is set.',
+    type=click.IntRange(min=1),
+    default=1,
+    show_default=True
+)
+def pagesearch_cli(input_dir: str, search_file: str, console: bool, recursive: bool, output: str, config: str,
+                   regex: bool, normalize: str | None, casefold: bool, index: str | None, copy_mode: str | None,
+                   jobs: int):
     """
     Search for characters in set of PageXML files.
 
@@ -308,8 +465,14 @@ def pagesearch_cli(input_dir: str, search_file: str, console: bool, recursive: b
         input_dir=Path(input_dir).absolute(),
         output_dir=None if output is None else Path(output).absolute(),
         recursive=recursive,
-        config=Path(config).absolute()
+        config=Path(config).absolute(),
+        copy_mode=copy_mode
     ).search(
         search_fp=Path(search_file).absolute(),
-        console=console or (output is None)
+        console=console or (output is None),
+        regex=regex,
+        normalize=None if normalize is None else normalize.upper(),
+        casefold=casefold,
+        index=None if index is None else Path(index).absolute(),
+        jobs=jobs
     )
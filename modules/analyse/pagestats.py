@@ -1,10 +1,262 @@
+import csv
+from collections import Counter
+from pathlib import Path
+
 import click
+from lxml import etree
+
+from helper.parallel import parallel_map, echo_failures
+from helper.profiling import count, stage
+from helper.stream import get_line_text
+
+FILES_HEADER = ['file', 'regions', 'lines', 'chars']
+REGIONS_HEADER = ['file', 'region', 'count']
+CHARS_HEADER = ['char', 'codepoint', 'count']
+DISTRIBUTION_HEADER = ['metric', 'value', 'count']
+
+
+class PageStats:
+    def __init__(self) -> None:
+        """
+        Mergeable statistics of one or more PageXML files.
+        All distributions are stored as histograms, so merging is cheap and memory does not grow with the corpus.
+        """
+        self.files: int = 0
+        self.regions: Counter = Counter()  # region type -> count
+        self.lines: int = 0
+        self.chars: Counter = Counter()  # character -> count
+        self.heights: Counter = Counter()  # line height in pixels -> count
+        self.widths: Counter = Counter()  # line width in pixels -> count
+
+    def merge(self, other: 'PageStats') -> None:
+        """
+        Adds statistics of another object to this one
+
+        :param other: statistics to add
+        :return: None
+        """
+        self.files += other.files
+        self.regions.update(other.regions)
+        self.lines += other.lines
+        self.chars.update(other.chars)
+        self.heights.update(other.heights)
+        self.widths.update(other.widths)
+
+    @classmethod
+    def from_xml(cls, fp: Path) -> 'PageStats':
+        """
+        Collects statistics of a single PageXML file, streaming through the file with lxml iterparse
+
+        :param fp: path to PageXML file
+        :return: statistics of the file
+        """
+        with stage('parse'):
+            stats = cls.__parse(fp)
+        count('files')
+        count('lines', stats.lines)
+        return stats
+
+    @classmethod
+    def __parse(cls, fp: Path) -> 'PageStats':
+        """ Parses a single PageXML file, see from_xml """
+        stats = cls()
+        stats.files = 1
+        for _, element in etree.iterparse(str(fp), events=('end',)):
+            name = etree.QName(element).localname
+            if name == 'TextLine':
+                stats.lines += 1
+                stats.chars.update(get_line_text(element))
+                coords = next(element.iterchildren('{*}Coords'), None)
+                if coords is not None and coords.get('points'):
+                    xs, ys = zip(*(map(int, p.split(',')) for p in coords.get('points').split()))
+                    stats.widths[max(xs) - min(xs)] += 1
+                    stats.heights[max(ys) - min(ys)] += 1
+            elif name.endswith('Region'):
+                stats.regions[name if element.get('type') is None else f'{name}:{element.get("type")}'] += 1
+            else:
+                continue
+            # discard finished element and already processed siblings
+            element.clear()
+            while element.getprevious() is not None:
+                del element.getparent()[0]
+        return stats
+
+
+class TableWriter:
+    def __init__(self, fp: Path, header: list[str], fmt: str = 'csv', batch_size: int = 10000) -> None:
+        """
+        Writes rows incrementally to a CSV or Parquet file
+
+        :param fp: output file path, suffix is added automatically
+        :param header: column names
+        :param fmt: output format, csv or parquet (requires pyarrow)
+        :param batch_size: number of buffered rows per parquet row group
+        """
+        self.__header = header
+        self.__fmt = fmt
+        self.__batch_size = batch_size
+        self.__rows: list[list] = []
+        self.__writer = None
+        if fmt == 'parquet':
+            import pyarrow.parquet as pq
+            self.__pq = pq
+            self.__fp = fp.with_suffix('.parquet')
+        else:
+            self.__file = open(fp.with_suffix('.csv'), 'w', encoding='utf-8', newline='')
+            self.__csv = csv.writer(self.__file)
+            self.__csv.writerow(header)
+
+    def write(self, row: list) -> None:
+        """
+        Writes a single row
 
+        :param row: list of values in column order
+        :return: None
+        """
+        if self.__fmt != 'parquet':
+            self.__csv.writerow(row)
+            return
+        self.__rows.append(row)
+        if len(self.__rows) >= self.__batch_size:
+            self.__flush()
 
-@click.command('pagestats', short_help='Outputs stats of PageXML files. (not implemented)')
+    def __flush(self) -> None:
+        """
+        Writes buffered rows as parquet row group
+
+        :return: None
+        """
+        if not self.__rows:
+            return
+        import pyarrow as pa
+        table = pa.Table.from_pylist([dict(zip(self.__header, row)) for row in self.__rows])
+        if self.__writer is None:
+            self.__writer = self.__pq.ParquetWriter(self.__fp, table.schema)
+        self.__writer.write_table(table)
+        self.__rows = []
+
+    def close(self) -> None:
+        """
+        Flushes remaining rows and closes the file
+
+        :return: None
+        """
+        if self.__fmt != 'parquet':
+            self.__file.close()
+            return
+        self.__flush()
+        if self.__writer is not None:
+            self.__writer.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+
+def pagestats(files: list[Path], out_dir: Path, root: Path, fmt: str = 'csv', jobs: int = 1) -> PageStats:
+    """
+    Collects statistics of PageXML files. Per file results are written as soon as a file is processed,
+    corpus wide histograms (characters, line heights and widths) are written at the end.
+
+    :param files: list of PageXML files
+    :param out_dir: output directory
+    :param root: file names in output are relative to this directory
+    :param fmt: output format, csv or parquet
+    :param jobs: number of worker processes
+    :return: merged statistics of all files
+    """
+    out_dir.mkdir(parents=True, exist_ok=True)
+    total = PageStats()
+    failures = []
+    with (TableWriter(out_dir.joinpath('files'), FILES_HEADER, fmt) as files_out,
+          TableWriter(out_dir.joinpath('regions'), REGIONS_HEADER, fmt) as regions_out):
+        # in order of files, so outputs (including ties of the character histogram) do not depend on jobs
+        for fp, stats, error in parallel_map(PageStats.from_xml, files, jobs=jobs, label='Analysing PageXML',
+                                             ordered=True):
+            if error is not None:
+                failures.append((fp.name, error))
+                continue
+            name = fp.relative_to(root).as_posix()
+            with stage('io'):
+                files_out.write([name, sum(stats.regions.values()), stats.lines, sum(stats.chars.values())])
+                for region, n in sorted(stats.regions.items()):
+                    regions_out.write([name, region, n])
+            total.merge(stats)
+
+    with TableWriter(out_dir.joinpath('chars'), CHARS_HEADER, fmt) as chars_out:
+        for char, n in total.chars.most_common():
+            chars_out.write([char, f'U+{ord(char):04X}', n])
+    with TableWriter(out_dir.joinpath('distribution'), DISTRIBUTION_HEADER, fmt) as dist_out:
+        for metric, histogram in [('line_height', total.heights), ('line_width', total.widths)]:
+            for value, n in sorted(histogram.items()):
+                dist_out.write([metric, value, n])
+    echo_failures(failures)
+    return total
+
+
+@click.command('pagestats', short_help='Outputs stats of PageXML files.')
 @click.help_option('--help', '-h')
-def pagestats_cli():
+@click.argument(
+    'xmls',
+    type=click.Path(exists=True, dir_okay=True, file_okay=True),
+    required=True
+)
+@click.argument(
+    'out_dir',
+    type=click.Path(exists=False, dir_okay=True, file_okay=False),
+    required=True
+)
+@click.option(
+    '-g', '--glob', 'pattern',
+    help='Glob pattern for PageXML files. Ignored if XMLS points to a file.',
+    type=click.STRING,
+    default='*.xml',
+    show_default=True
+)
+@click.option(
+    '-r', '--recursive',
+    help='Recursive search in input directory.',
+    is_flag=True,
+    type=bool,
+    default=False
+)
+@click.option(
+    '-f', '--format', 'fmt',
+    help='Output format. Parquet requires pyarrow.',
+    type=click.Choice(['csv', 'parquet']),
+    default='csv',
+    show_default=True
+)
+@click.option(
+    '-j', '--jobs',
+    help='Number of worker processes.',
+    type=click.IntRange(min=1),
+    default=1,
+    show_default=True
+)
+def pagestats_cli(xmls: str, out_dir: str, pattern: str, recursive: bool, fmt: str, jobs: int):
     """
-    Pagestats
+    Outputs stats of PageXML files.
+
+    Writes to OUT_DIR:
+    files (regions, lines and characters per file),
+    regions (count of each region type per file),
+    chars (character histogram),
+    distribution (histograms of line heights and widths).
     """
-    click.echo('Not implemented.')
+    in_fp = Path(xmls)
+    if in_fp.is_dir():
+        files = sorted(in_fp.rglob(pattern) if recursive else in_fp.glob(pattern))
+        root = in_fp
+    else:
+        files = [in_fp]
+        root = in_fp.parent
+    if fmt == 'parquet':
+        try:
+            import pyarrow  # noqa: F401
+        except ImportError:
+            raise click.UsageError('Parquet output requires pyarrow.')
+    total = pagestats(files, Path(out_dir), root, fmt, jobs)
+    click.echo(f'Done! ({total.files} files, {sum(total.regions.values())} regions, {total.lines} lines)')
@@ -0,0 +1,358 @@
+import json
+import os
+import platform
+import subprocess
+import sys
+import tempfile
+import time
+from concurrent.futures import ProcessPoolExecutor
+from datetime import datetime, timezone
+from functools import partial
+from multiprocessing import get_context
+from pathlib import Path
+from typing import Callable
+
+import click
+
+from .corpus import CORPUS_FILE, generate_corpus
+
+SCENARIOS: dict[str, Callable[[Path, Path, dict, int], dict]] = {}
+ROOT = Path(__file__).parent.parent.parent
+HEAVY_MODULES = ['cv2', 'fitz', 'PIL', 'shapely', 'numpy', 'pyarrow', 'lxml', 'pagexml', 'pandas']
+STARTUP_RUNS = 10
+# fixed, so newly registered fixes do not change what the pagefix scenario measures
+PAGEFIX_FIXES = ['filename', 'regions', 'assign', 'order', 'type', 'coords', 'lines', 'spikes']
+STARTUP_COMMANDS = [['--help'], ['csv2txt', '--help']]
+STARTUP_CHECK = f"""
+import sys
+import htrtools
+try:
+    htrtools.cli(sys.argv[1:])
+except SystemExit:
+    pass
+print(','.join(m for m in {HEAVY_MODULES!r} if m in sys.modules), file=sys.stderr)
+"""
+
+
+def scenario(name: str) -> Callable:
+    """
+    Decorator to register a benchmark scenario. A scenario gets the corpus directory, an empty working directory,
+    the corpus description and the number of jobs, and returns the processed units (files, lines, bytes, ...)
+
+    :param name: name of the scenario
+    :return: decorator
+    """
+    def register(func: Callable) -> Callable:
+        SCENARIOS[name] = func
+        return func
+    return register
+
+
+def peak_rss() -> float | None:
+    """ Returns peak resident set size of this process and its finished child processes in MiB """
+    try:
+        import resource
+    except ImportError:  # not available on Windows
+        return None
+    scale = 1 if sys.platform == 'darwin' else 1024  # bytes on macOS, kibibytes on Linux
+    peak = max(resource.getrusage(resource.RUSAGE_SELF).ru_maxrss,
+               resource.getrusage(resource.RUSAGE_CHILDREN).ru_maxrss)
+    return round(peak * scale / 2 ** 20, 1)
+
+
+def run_scenario(name: str, corpus: Path, jobs: int) -> dict:
+    """
+    Runs a single scenario in a temporary working directory, output of the scenario is discarded.
+    Meant to be called in a fresh process, so that peak memory is not shared between scenarios.
+
+    :param name: name of the scenario
+    :param corpus: corpus directory
+    :param jobs: number of jobs passed to the scenario
+    :return: wall time in seconds, processed units and peak memory
+    """
+    with open(corpus.joinpath(CORPUS_FILE), 'r', encoding='utf-8') as f:
+        info = json.load(f)
+    with open(os.devnull, 'w') as devnull:  # discard output on file descriptor level, progressbars included
+        os.dup2(devnull.fileno(), 1)
+        os.dup2(devnull.fileno(), 2)
+    with tempfile.TemporaryDirectory() as tmp:
+        start = time.perf_counter()
+        units = SCENARIOS[name](corpus, Path(tmp), info, jobs)
+        seconds = time.perf_counter() - start
+    return {'seconds': seconds, **units, 'peak_rss_mb': peak_rss()}
+
+
+def throughput(result: dict) -> dict:
+    """ Adds files/s, lines/s and MB/s to a scenario result """
+    seconds = result['seconds']
+    for unit, key in [('files', 'files_per_s'), ('lines', 'lines_per_s'), ('annotations', 'annotations_per_s'),
+                      ('invocations', 'invocations_per_s')]:
+        if unit in result:
+            result[key] = round(result[unit] / seconds, 2)
+    if 'bytes' in result:
+        result['mb_per_s'] = round(result['bytes'] / 2 ** 20 / seconds, 2)
+    result['seconds'] = round(seconds, 4)
+    return result
+
+
+def bench(corpus: Path, names: list[str], jobs: int = 1, repeat: int = 1) -> dict:
+    """
+    Runs scenarios, each run in a fresh process. The fastest run of each scenario is reported.
+
+    :param corpus: corpus directory created by generate_corpus
+    :param names: names of scenarios
+    :param jobs: number of jobs passed to the scenarios
+    :param repeat: number of runs per scenario
+    :return: report with environment information and results by scenario
+    """
+    with open(corpus.joinpath(CORPUS_FILE), 'r', encoding='utf-8') as f:
+        info = json.load(f)
+    results = {}
+    for name in names:
+        runs = []
+        for _ in range(repeat):
+            with ProcessPoolExecutor(max_workers=1, mp_context=get_context('spawn')) as executor:
+                try:
+                    runs.append(executor.submit(run_scenario, name, corpus, jobs).result())
+                except Exception as e:
+                    results[name] = {'error': f'{type(e).__name__}: {e}'}
+                    break
+        else:
+            best = min(runs, key=lambda r: r['seconds'])
+            if best['peak_rss_mb'] is not None:
+                best['peak_rss_mb'] = max(r['peak_rss_mb'] for r in runs)
+            results[name] = throughput(best)
+        click.echo(f'{name}: {results[name]}', err=True)
+    return {
+        'created': datetime.now(timezone.utc).isoformat(timespec='seconds'),
+        'python': platform.python_version(),
+        'platform': platform.platform(),
+        'cpus': os.cpu_count(),
+        'jobs': jobs,
+        'repeat': repeat,
+        'corpus': info['parameters'],
+        'results': results,
+    }
+
+
+@scenario('startup')
+def bench_startup(corpus: Path, work: Path, info: dict, jobs: int) -> dict:
+    """ Startup time of the command line interface. Fails if help pages import heavy dependencies """
+    for args in STARTUP_COMMANDS:
+        loaded = subprocess.run([sys.executable, '-c', STARTUP_CHECK, *args], cwd=ROOT, capture_output=True,
+                                text=True, check=True).stderr.strip()
+        if loaded:
+            raise RuntimeError(f'htrtools {" ".join(args)} imports {loaded}')
+    for _ in range(STARTUP_RUNS):
+        for args in STARTUP_COMMANDS:
+            subprocess.run([sys.executable, ROOT.joinpath('htrtools.py'), *args], capture_output=True, check=True)
+    return {'invocations': (STARTUP_RUNS + 1) * len(STARTUP_COMMANDS)}  # including import check
+
+
+@scenario('pagefix')
+def bench_pagefix(corpus: Path, work: Path, info: dict, jobs: int) -> dict:
+    from modules.manipulation.pagefix import pagefix
+    from helper.parallel import parallel_map
+
+    files = sorted(corpus.joinpath('pages').glob('*.xml'))
+    worker = partial(pagefix, out_dir=work, fixes=PAGEFIX_FIXES)
+    for _, _, error in parallel_map(worker, files, jobs=jobs):
+        if error is not None:
+            raise RuntimeError(error)
+    return {k: info['pages'][k] for k in ('files', 'lines', 'bytes')}
+
+
+@scenario('pagesearch')
+def bench_pagesearch(corpus: Path, work: Path, info: dict, jobs: int) -> dict:
+    from modules.analyse.pagesearch import PageSearch
+
+    PageSearch(
+        input_dir=corpus.joinpath('pages'),
+        output_dir=work.joinpath('results'),
+        recursive=True,
+        config=corpus.joinpath('pagesearch.cfg')
+    ).search(corpus.joinpath('search.txt'), jobs=jobs)
+    return {k: info['pages'][k] for k in ('files', 'lines', 'bytes')}
+
+
+@scenario('pageindex')
+def bench_pageindex(corpus: Path, work: Path, info: dict, jobs: int) -> dict:
+    from modules.analyse.pageindex import PageIndex
+    from modules.analyse.pagesearch import parse_search
+
+    with PageIndex(work.joinpath('index.sqlite')) as pi:
+        pi.update(sorted(corpus.joinpath('pages').glob('*.xml')))
+        pi.search(parse_search(corpus.joinpath('search.txt')))
+    return {k: info['pages'][k] for k in ('files', 'lines', 'bytes')}
+
+
+@scenario('pagestats')
+def bench_pagestats(corpus: Path, work: Path, info: dict, jobs: int) -> dict:
+    from modules.analyse.pagestats import pagestats
+
+    pagestats(sorted(corpus.joinpath('pages').glob('*.xml')), work, corpus.joinpath('pages'), jobs=jobs)
+    return {k: info['pages'][k] for k in ('files', 'lines', 'bytes')}
+
+
+def _coco2page(corpus: Path, work: Path, info: dict, jobs: int, stream: bool) -> dict:
+    from modules.parser.coco2page import DEFAULT_MAPPING, coco2page
+
+    with open(DEFAULT_MAPPING, 'r') as f:
+        mapping = dict(json.load(f))
+    coco2page(corpus.joinpath('coco.json'), work, mapping, 'htrtools bench', False, stream=stream, jobs=jobs)
+    return {k: info['coco'][k] for k in ('files', 'annotations', 'bytes')}
+
+
+@scenario('coco2page')
+def bench_coco2page(corpus: Path, work: Path, info: dict, jobs: int) -> dict:
+    return _coco2page(corpus, work, info, jobs, stream=False)
+
+
+@scenario('coco2page-stream')
+def bench_coco2page_stream(corpus: Path, work: Path, info: dict, jobs: int) -> dict:
+    return _coco2page(corpus, work, info, jobs, stream=True)
+
+
+def _img2img(corpus: Path, work: Path, info: dict, jobs: int, fast: bool) -> dict:
+    from modules.parser.img2img import img2img
+
+    img2img(corpus.joinpath('images'), work, '.jpg', '.png', 1000, jobs=jobs, fast=fast)
+    return {k: info['images'][k] for k in ('files', 'bytes')}
+
+
+@scenario('img2img')
+def bench_img2img(corpus: Path, work: Path, info: dict, jobs: int) -> dict:
+    return _img2img(corpus, work, info, jobs, fast=False)
+
+
+@scenario('img2img-fast')
+def bench_img2img_fast(corpus: Path, work: Path, info: dict, jobs: int) -> dict:
+    return _img2img(corpus, work, info, jobs, fast=True)
+
+
+@scenario('pdf2img')
+def bench_pdf2img(corpus: Path, work: Path, info: dict, jobs: int) -> dict:
+    from modules.parser.pdf2img import pdf2img
+
+    pdf2img(corpus.joinpath('document.pdf'), work, '.png', 1000, 300, jobs=jobs)
+    return {k: info['pdf'][k] for k in ('files', 'bytes')}
+
+
+@click.group('bench', short_help='Benchmark subcommands on a synthetic corpus.')
+@click.help_option('--help', '-h')
+def bench_cli():
+    """
+    Benchmark subcommands on a deterministic synthetic corpus.
+
+    Generate a corpus once, run scenarios with each version and compare the JSON reports.
+    """
+
+
+@bench_cli.command('generate', short_help='Generate a synthetic corpus.')
+@click.help_option('--help', '-h')
+@click.argument(
+    'out_dir',
+    type=click.Path(exists=False, dir_okay=True, file_okay=False),
+    required=True
+)
+@click.option('--files', help='Number of PageXML files.', type=click.IntRange(min=0), default=100, show_default=True)
+@click.option('--regions', help='Regions per PageXML file.', type=click.IntRange(min=1), default=4, show_default=True)
+@click.option('--lines', help='Lines per region.', type=click.IntRange(min=1), default=25, show_default=True)
+@click.option('--vertices', help='Vertices per line and COCO polygon.', type=click.IntRange(min=4), default=60,
+              show_default=True)
+@click.option('--coco-images', help='Images in COCO file.', type=click.IntRange(min=0), default=200,
+              show_default=True)
+@click.option('--coco-annotations', help='Annotations per COCO image.', type=click.IntRange(min=1), default=20,
+              show_default=True)
+@click.option('--images', help='Number of scan images.', type=click.IntRange(min=0), default=10, show_default=True)
+@click.option('--image-size', help='Width and height of scan images.', type=(int, int), default=(2500, 3500),
+              show_default=True)
+@click.option('--pdf-pages', help='Number of PDF pages.', type=click.IntRange(min=1), default=20, show_default=True)
+@click.option('--seed', help='Random seed.', type=click.INT, default=0, show_default=True)
+def bench_generate_cli(out_dir: str, files: int, regions: int, lines: int, vertices: int, coco_images: int,
+                       coco_annotations: int, images: int, image_size: tuple[int, int], pdf_pages: int, seed: int):
+    """
+    Generates a synthetic corpus in OUT_DIR: PageXML files, a COCO file, scan images and a PDF file.
+
+    The same options always produce the same corpus.
+    """
+    corpus = generate_corpus(Path(out_dir), files, regions, lines, vertices, coco_images, coco_annotations, images,
+                             image_size, pdf_pages, seed)
+    click.echo(json.dumps(corpus, indent=2))
+
+
+@bench_cli.command('run', short_help='Run benchmark scenarios.')
+@click.help_option('--help', '-h')
+@click.argument(
+    'corpus',
+    type=click.Path(exists=True, dir_okay=True, file_okay=False),
+    required=True
+)
+@click.option(
+    '-s', '--scenario', 'names',
+    help='Scenario to run. Can be used multiple times, runs all scenarios if not set.',
+    type=click.Choice(list(SCENARIOS)),
+    multiple=True
+)
+@click.option(
+    '-j', '--jobs',
+    help='Number of jobs passed to the scenarios.',
+    type=click.IntRange(min=1),
+    default=1,
+    show_default=True
+)
+@click.option(
+    '-n', '--repeat',
+    help='Runs per scenario, the fastest run is reported.',
+    type=click.IntRange(min=1),
+    default=1,
+    show_default=True
+)
+@click.option(
+    '-o', '--output',
+    help='Write JSON report to file instead of stdout.',
+    type=click.Path(exists=False, dir_okay=False, file_okay=True),
+    required=False
+)
+def bench_run_cli(corpus: str, names: tuple[str], jobs: int, repeat: int, output: str | None):
+    """
+    Runs benchmark scenarios on CORPUS and reports wall time, throughput and peak memory as JSON.
+
+    Each run happens in a fresh process. Peak memory includes finished worker processes.
+    """
+    report = bench(Path(corpus).absolute(), list(names) or list(SCENARIOS), jobs, repeat)
+    if output is None:
+        click.echo(json.dumps(report, indent=2))
+    else:
+        with open(output, 'w', encoding='utf-8') as f:
+            json.dump(report, f, indent=2)
+
+
+@bench_cli.command('compare', short_help='Compare two benchmark reports.')
+@click.help_option('--help', '-h')
+@click.argument(
+    'baseline',
+    type=click.Path(exists=True, dir_okay=False, file_okay=True),
+    required=True
+)
+@click.argument(
+    'report',
+    type=click.Path(exists=True, dir_okay=False, file_okay=True),
+    required=True
+)
+def bench_compare_cli(baseline: str, report: str):
+    """
+    Prints wall time and peak memory of REPORT relative to BASELINE.
+    """
+    with open(baseline, 'r', encoding='utf-8') as f:
+        old = json.load(f)['results']
+    with open(report, 'r', encoding='utf-8') as f:
+        new = json.load(f)['results']
+    click.echo(f'{"scenario":<18} {"old s":>10} {"new s":>10} {"speedup":>8} {"old MiB":>9} {"new MiB":>9}')
+    for name in [n for n in old if n in new]:
+        a, b = old[name], new[name]
+        if 'error' in a or 'error' in b:
+            click.echo(f'{name:<18} {a.get("error", "") or b.get("error", "")}')
+            continue
+        click.echo(f'{name:<18} {a["seconds"]:>10.3f} {b["seconds"]:>10.3f} {a["seconds"] / b["seconds"]:>7.2f}x '
+                   f'{a["peak_rss_mb"] or 0:>9.1f} {b["peak_rss_mb"] or 0:>9.1f}')
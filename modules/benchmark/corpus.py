@@ -0,0 +1,223 @@
+import io
+import json
+import random
+from pathlib import Path
+
+import numpy as np
+from lxml import etree
+from PIL import Image
+
+PAGE_NS = 'http://schema.primaresearch.org/PAGE/gts/pagecontent/2019-07-15'
+ALPHABET = 'abcdefghiklmnopqrstuvwxyzſꝛäöüABCDEFGHIKLMNOPRSTVW'
+SEARCH = ['ꝛ', 'ſt', 'und', 'Ä', 'qu']
+COCO_CATEGORIES = ['paragraph', 'caption', 'figure', 'heading']
+CORPUS_FILE = 'corpus.json'
+PAGESEARCH_CONFIG = """[EXTENSIONS]
+xml = .xml
+copy =
+    .xml > .xml
+xml_update =
+
+[EXCLUDED]
+files =
+folders =
+"""
+
+
+def random_text(rnd: random.Random, words: int) -> str:
+    """ Returns a line of random words, with some words from the search list mixed in """
+    return ' '.join(rnd.choice(SEARCH) if rnd.random() < 0.05 else
+                    ''.join(rnd.choices(ALPHABET, k=rnd.randint(2, 9))) for _ in range(words))
+
+
+def polygon(rnd: random.Random, x0: int, y0: int, x1: int, y1: int, vertices: int) -> list[tuple[int, int]]:
+    """ Returns a jittered polygon inside a box, vertices are spread evenly over upper and lower edge """
+    top = max(2, vertices // 2)
+    xs = np.linspace(x0, x1, top).round().astype(int).tolist()
+    upper = [(x, y0 + rnd.randint(-2, 2)) for x in xs]
+    lower = [(x, y1 + rnd.randint(-2, 2)) for x in reversed(xs)]
+    return upper + lower[:max(2, vertices - top)]
+
+
+def points(coords: list[tuple[int, int]]) -> str:
+    """ Returns PageXML points attribute of a list of coordinates """
+    return ' '.join(f'{x},{y}' for x, y in coords)
+
+
+def write_pagexml(fp: Path, rnd: random.Random, regions: int, lines: int, vertices: int,
+                  width: int = 2500, height: int = 3500) -> int:
+    """
+    Writes a synthetic PageXML file, shaped like the output of Kraken: absolute image path, region type in custom
+    attribute, some negative coordinates and lines in random order
+
+    :param fp: output file
+    :param rnd: random generator
+    :param regions: number of text regions
+    :param lines: number of lines per region
+    :param vertices: number of vertices per line polygon
+    :param width: image width
+    :param height: image height
+    :return: number of lines written
+    """
+    root = etree.Element(f'{{{PAGE_NS}}}PcGts', nsmap={None: PAGE_NS})
+    metadata = etree.SubElement(root, f'{{{PAGE_NS}}}Metadata')
+    etree.SubElement(metadata, f'{{{PAGE_NS}}}Creator').text = 'htrtools bench'
+    page = etree.SubElement(root, f'{{{PAGE_NS}}}Page', imageFilename=f'/data/scans/{fp.stem}.png',
+                            imageWidth=str(width), imageHeight=str(height))
+    region_height = height // max(1, regions)
+    line_height = region_height // max(1, lines)
+    for r in range(regions):
+        y0 = r * region_height
+        region = etree.SubElement(page, f'{{{PAGE_NS}}}TextRegion', id=f'r{r}',
+                                  custom=f'structure {{type:{rnd.choice(["paragraph", "heading"])};}}')
+        etree.SubElement(region, f'{{{PAGE_NS}}}Coords',
+                         points=points([(-3, y0), (width + 2, y0), (width + 2, y0 + region_height - 1),
+                                        (-3, y0 + region_height - 1)]))
+        order = list(range(lines))
+        rnd.shuffle(order)
+        for n in order:
+            ly0 = y0 + n * line_height + 2
+            ly1 = ly0 + line_height - 4
+            line = etree.SubElement(region, f'{{{PAGE_NS}}}TextLine', id=f'r{r}l{n}')
+            etree.SubElement(line, f'{{{PAGE_NS}}}Coords', points=points(polygon(rnd, 40, ly0, width - 40, ly1,
+                                                                                   vertices)))
+            etree.SubElement(line, f'{{{PAGE_NS}}}Baseline', points=points([(40, ly1 - 4), (width - 40, ly1 - 4)]))
+            equiv = etree.SubElement(line, f'{{{PAGE_NS}}}TextEquiv', index='0')
+            etree.SubElement(equiv, f'{{{PAGE_NS}}}Unicode').text = random_text(rnd, rnd.randint(4, 12))
+    etree.ElementTree(root).write(str(fp), xml_declaration=True, encoding='UTF-8', pretty_print=True)
+    return regions * lines
+
+
+def scan_image(rnd: random.Random, width: int, height: int, lines: int = 40) -> Image.Image:
+    """ Returns a grayscale image resembling a scanned page: noisy paper with dark text lines """
+    rng = np.random.default_rng(rnd.getrandbits(32))
+    pixels = rng.normal(230, 10, (height, width))
+    line_height = height // (lines + 2)
+    for n in range(1, lines + 1):
+        y = n * line_height
+        x = width // 12
+        while x < width * 11 // 12:
+            word = rnd.randint(width // 60, width // 12)
+            block = pixels[y:y + line_height // 2, x:x + word]
+            block -= rng.normal(170, 20, block.shape)
+            x += word + width // 80
+    return Image.fromarray(np.clip(pixels, 0, 255).astype(np.uint8), mode='L')
+
+
+def write_coco(fp: Path, rnd: random.Random, images: int, annotations: int, vertices: int,
+               width: int = 2500, height: int = 3500) -> int:
+    """
+    Writes a synthetic COCO file with polygon segmentations
+
+    :param fp: output file
+    :param rnd: random generator
+    :param images: number of images
+    :param annotations: number of annotations per image
+    :param vertices: number of vertices per segmentation polygon
+    :param width: image width
+    :param height: image height
+    :return: number of annotations written
+    """
+    coco = {
+        'images': [{'id': i + 1, 'file_name': f'scan_{i:05d}.jpg', 'width': width, 'height': height}
+                   for i in range(images)],
+        'categories': [{'id': i + 1, 'name': name} for i, name in enumerate(COCO_CATEGORIES)],
+        'annotations': []
+    }
+    box_height = height // max(1, annotations)
+    for i in range(images):
+        for n in range(annotations):
+            y0 = n * box_height
+            coords = polygon(rnd, 50, y0 + 2, width - 50, y0 + box_height - 2, vertices)
+            coco['annotations'].append({
+                'id': len(coco['annotations']) + 1,
+                'image_id': i + 1,
+                'category_id': rnd.randint(1, len(COCO_CATEGORIES)),
+                'bbox': [50, y0 + 2, width - 100, box_height - 4],
+                'segmentation': [[v for xy in coords for v in xy]],
+                'area': (width - 100) * (box_height - 4),
+                'iscrowd': 0
+            })
+    rnd.shuffle(coco['annotations'])  # annotations are not grouped by image in real exports
+    with open(fp, 'w', encoding='utf-8') as f:
+        json.dump(coco, f)
+    return len(coco['annotations'])
+
+
+def write_pdf(fp: Path, rnd: random.Random, pages: int) -> None:
+    """
+    Writes a synthetic PDF file, each page with an embedded scan image and a text layer
+
+    :param fp: output file
+    :param rnd: random generator
+    :param pages: number of pages
+    :return: None
+    """
+    import fitz
+
+    buffer = io.BytesIO()
+    scan_image(rnd, 1240, 1754).save(buffer, format='JPEG', quality=85)
+    doc = fitz.open()
+    for _ in range(pages):
+        page = doc.new_page(width=595, height=842)  # A4
+        page.insert_image(page.rect, stream=buffer.getvalue())
+        for n in range(40):
+            page.insert_text((50, 60 + n * 19), random_text(rnd, 10).encode('ascii', 'replace').decode(),
+                             fontsize=10)
+    doc.set_metadata({})  # no creation date, same as no_new_id: identical files for identical parameters
+    doc.save(fp, no_new_id=True)
+    doc.close()
+
+
+def generate_corpus(out_dir: Path, files: int = 100, regions: int = 4, lines: int = 25, vertices: int = 60,
+                    coco_images: int = 200, coco_annotations: int = 20, images: int = 10,
+                    image_size: tuple[int, int] = (2500, 3500), pdf_pages: int = 20, seed: int = 0) -> dict:
+    """
+    Generates a deterministic synthetic corpus for benchmarks. Same parameters always produce the same files.
+
+    :param out_dir: output directory
+    :param files: number of PageXML files
+    :param regions: number of regions per PageXML file
+    :param lines: number of lines per region
+    :param vertices: number of vertices per line and COCO polygon
+    :param coco_images: number of images in COCO file
+    :param coco_annotations: number of annotations per COCO image
+    :param images: number of scan images
+    :param image_size: width and height of scan images
+    :param pdf_pages: number of PDF pages
+    :param seed: random seed
+    :return: description of the corpus, also written to corpus.json
+    """
+    rnd = random.Random(seed)
+    pages_dir, images_dir = out_dir.joinpath('pages'), out_dir.joinpath('images')
+    pages_dir.mkdir(parents=True, exist_ok=True)
+    images_dir.mkdir(parents=True, exist_ok=True)
+
+    total_lines = sum(write_pagexml(pages_dir.joinpath(f'page_{i:05d}.xml'), rnd, regions, lines, vertices)
+                      for i in range(files))
+    out_dir.joinpath('pagesearch.cfg').write_text(PAGESEARCH_CONFIG, encoding='utf-8')
+    out_dir.joinpath('search.txt').write_text('\n'.join(SEARCH) + '\n', encoding='utf-8')
+
+    coco_fp = out_dir.joinpath('coco.json')
+    annotations = write_coco(coco_fp, rnd, coco_images, coco_annotations, vertices)
+
+    for i in range(images):
+        scan_image(rnd, *image_size).save(images_dir.joinpath(f'scan_{i:05d}.jpg'), quality=90)
+
+    pdf_fp = out_dir.joinpath('document.pdf')
+    write_pdf(pdf_fp, rnd, pdf_pages)
+
+    corpus = {
+        'parameters': {'files': files, 'regions': regions, 'lines': lines, 'vertices': vertices,
+                       'coco_images': coco_images, 'coco_annotations': coco_annotations, 'images': images,
+                       'image_size': list(image_size), 'pdf_pages': pdf_pages, 'seed': seed},
+        'pages': {'files': files, 'lines': total_lines, 'vertices': total_lines * vertices,
+                  'bytes': sum(fp.stat().st_size for fp in pages_dir.glob('*.xml'))},
+        'coco': {'files': coco_images, 'annotations': annotations, 'bytes': coco_fp.stat().st_size},
+        'images': {'files': images, 'pixels': images * image_size[0] * image_size[1],
+                   'bytes': sum(fp.stat().st_size for fp in images_dir.glob('*.jpg'))},
+        'pdf': {'files': pdf_pages, 'bytes': pdf_fp.stat().st_size},
+    }
+    with open(out_dir.joinpath(CORPUS_FILE), 'w', encoding='utf-8') as f:
+        json.dump(corpus, f, indent=2)
+    return corpus
@@ -1,105 +1,415 @@
+import filecmp
+import os
+from functools import partial
 from pathlib import Path
 
 import click
+import numpy as np
 
-from pagexml import PageXML, Element
+from pagexml import PageXML, Page, Element, ElementType
+from helper.cache import Manifest, file_hash
+from helper.geometry import Polygon, SpatialIndex
 from helper.page import get_page_regions, get_coords, get_coords_element, get_region_elements
+from helper.parallel import parallel_map, echo_failures
+from helper.profiling import count, stage
+
+MANIFEST = '.pagefix.json'
+
+
+class PageContext:
+    def __init__(self, page: Page):
+        """
+        Per page state shared by all fixes of a traversal.
+        Coordinates are parsed once per element and written back once, after all fixes ran.
+
+        :param page: page element
+        """
+        self.page: Page = page
+        # id(element) -> (element, coords element, polygon). Entries keep their element alive: fixes remove elements
+        # from the page, an id could otherwise be reused by a new element and get its stale entry
+        self._coords: dict[int, tuple[Element, Element | None, Polygon]] = {}
+        self._changed: set[int] = set()
+
+    def coords(self, element: Element) -> Polygon:
+        """
+        Returns (cached) coordinates of an element
+
+        :param element: region or line element
+        :return: polygon, all zeros if element has no coordinates
+        """
+        if (key := id(element)) not in self._coords:
+            if (coords_element := get_coords_element(element)) is not None and 'points' in coords_element:
+                self._coords[key] = (element, coords_element, Polygon.from_page_coords(coords_element['points']))
+                count('elements')
+                count('vertices', len(self._coords[key][2]))
+            else:
+                self._coords[key] = (element, None, get_coords(element))
+        return self._coords[key][2]
+
+    def has_coords(self, element: Element) -> bool:
+        """
+        Checks if an element has a child with coordinates
+
+        :param element: region or line element
+        :return: True if coordinates were found
+        """
+        self.coords(element)
+        return self._coords[id(element)][1] is not None
+
+    def set_coords(self, element: Element, coords: Polygon) -> None:
+        """
+        Replaces coordinates of an element, written back on flush
+
+        :param element: region or line element
+        :param coords: new coordinates
+        :return: None
+        """
+        self.coords(element)
+        self._coords[id(element)] = (*self._coords[id(element)][:2], coords)
+        self._changed.add(id(element))
+
+    def flush(self) -> None:
+        """
+        Writes changed coordinates back to their elements
+
+        :return: None
+        """
+        for key in self._changed:
+            _, coords_element, coords = self._coords[key]
+            if coords_element is not None:
+                coords_element['points'] = coords.to_page_coords()
+        self._changed.clear()
+
+
+class Fix:
+    """
+    Base class of all fixes. All selected fixes share one traversal of each page:
+    begin_page hooks of all fixes, then region hooks of all fixes for each region, then end_page hooks.
+    Fixes run in order of registration. Options are passed to all fixes as keyword arguments,
+    each fix picks the ones it knows.
+    """
+    name: str = ''
+
+    def __init__(self, **options) -> None:
+        pass
+
+    def begin_page(self, ctx: PageContext) -> None:
+        """ Called before the regions of a page are traversed, may restructure the page """
+
+    def region(self, region: Element, ctx: PageContext) -> None:
+        """ Called for each region of a page """
+
+    def end_page(self, ctx: PageContext) -> None:
+        """ Called after all regions of a page were traversed """
+
+
+FIXES: dict[str, type[Fix]] = {}
+
+
+def register_fix(fix: type[Fix]) -> type[Fix]:
+    """
+    Class decorator to make a fix available to PageFix by its name
+
+    :param fix: subclass of Fix
+    :return: fix
+    """
+    FIXES[fix.name] = fix
+    return fix
+
+
+@register_fix
+class FilenameFix(Fix):
+    """ Updates imageFilename attribute of each page element from absolute to filename """
+    name = 'filename'
+
+    def begin_page(self, ctx: PageContext) -> None:
+        ctx.page['imageFilename'] = Path(ctx.page['imageFilename']).name
+
+
+@register_fix
+class RegionsFix(Fix):
+    """ Merge all regions with same region coordinates, or overlapping regions if a merge threshold is set """
+    name = 'regions'
+
+    def __init__(self, merge_threshold: float | None = None, merge_metric: str = 'iou', **options) -> None:
+        super().__init__(**options)
+        self._threshold = merge_threshold
+        self._metric = merge_metric
+
+    def begin_page(self, ctx: PageContext) -> None:
+        if self._threshold is None:
+            self._merge_identical(ctx)
+        else:
+            self._merge_overlapping(ctx)
+
+    @staticmethod
+    def _merge_identical(ctx: PageContext) -> None:
+        found_regions: dict[str, Element] = {}
+        for region in get_page_regions(ctx.page):
+            coords = ctx.coords(region).to_page_coords()
+            if coords in found_regions:
+                for element in region:
+                    found_regions[coords].add_element(element)
+            else:
+                region['id'] = f'r_{len(found_regions):04d}'
+                found_regions[coords] = region
+            ctx.page.remove_element(region)
+        for coords, region in found_regions.items():
+            ctx.page.add_element(region)
+
+    def _merge_overlapping(self, ctx: PageContext) -> None:
+        """ Merges groups of regions overlapping above the threshold, coordinates become the hull of the group """
+        regions = get_page_regions(ctx.page)
+        index = SpatialIndex([ctx.coords(region) for region in regions])
+        for region in regions:
+            ctx.page.remove_element(region)
+        for n, group in enumerate(index.clusters(self._threshold, self._metric)):
+            region = regions[group[0]]
+            for other in group[1:]:
+                for element in regions[other]:
+                    if 'points' not in element:  # keep coordinates of first region
+                        region.add_element(element)
+            if len(group) > 1 and ctx.has_coords(region):
+                ctx.set_coords(region, index.hull(group))
+            region['id'] = f'r_{n:04d}'
+            ctx.page.add_element(region)
+
+
+@register_fix
+class AssignFix(Fix):
+    """ Move TextLines outside of regions into the smallest region containing their center """
+    name = 'assign'
+
+    def begin_page(self, ctx: PageContext) -> None:
+        regions = get_page_regions(ctx.page)
+        orphans = [e for e in ctx.page if e.etype == ElementType.TextLine and ctx.has_coords(e)]
+        if not regions or not orphans:
+            return
+        index = SpatialIndex([ctx.coords(region) for region in regions])
+        targets = index.containing(Polygon.centers([ctx.coords(e) for e in orphans]))
+        for element, target in zip(orphans, targets.tolist()):
+            if target >= 0:
+                ctx.page.remove_element(element)
+                regions[target].add_element(element)
+
+
+@register_fix
+class OrderFix(Fix):
+    """ Create reading order element and add regions """
+    name = 'order'
+
+    def begin_page(self, ctx: PageContext) -> None:
+        self._ro = []
+
+    def region(self, region: Element, ctx: PageContext) -> None:
+        self._ro.append(region['id'])
+
+    def end_page(self, ctx: PageContext) -> None:
+        ctx.page.reading_order = self._ro
+
+
+@register_fix
+class TypeFix(Fix):
+    """ Updates region type from custom attribute """
+    name = 'type'
+
+    def region(self, region: Element, ctx: PageContext) -> None:
+        if (custom := region['custom']) is not None:
+            _type = custom.replace('structure {type:', '')
+            _type = _type.replace(';}', '')
+            region['type'] = _type
+
+
+@register_fix
+class CoordsFix(Fix):
+    """ Clip coordinates of regions and their elements to the image (negative coordinates to zero) """
+    name = 'coords'
+
+    def begin_page(self, ctx: PageContext) -> None:
+        width, height = ctx.page['imageWidth'], ctx.page['imageHeight']
+        self._max_x = None if width is None else int(width) - 1
+        self._max_y = None if height is None else int(height) - 1
+
+    def region(self, region: Element, ctx: PageContext) -> None:
+        for element in [region] + get_region_elements(region):
+            if not ctx.has_coords(element):
+                continue
+            coords = ctx.coords(element)
+            clipped = coords.clip(0, 0, self._max_x, self._max_y)
+            if not np.array_equal(clipped.to_array(), coords.to_array()):
+                ctx.set_coords(element, clipped)
+
+
+@register_fix
+class LinesFix(Fix):
+    """ Sort all lines of each region by its y coordinates """
+    name = 'lines'
+
+    def region(self, region: Element, ctx: PageContext) -> None:
+        elements = list(region.elements)
+        ys = Polygon.centers([ctx.coords(e) for e in elements])[:, 1]
+        region.elements[:] = [elements[i] for i in np.argsort(ys, kind='stable')]
+
+
+@register_fix
+class SpikesFix(Fix):
+    """ Remove spikes from elements coordinates """
+    name = 'spikes'
+
+    def region(self, region: Element, ctx: PageContext) -> None:
+        min_y = 0  # min y coordinate of previous text line
+        for element in get_region_elements(region):
+            if ctx.has_coords(element):
+                xy = ctx.coords(element).to_array()
+                ys = xy[:, 1]
+                if (ys <= min_y).any():
+                    xy[:, 1] = np.maximum(ys, min_y + 1)
+                    ctx.set_coords(element, Polygon.from_array(xy))
+                min_y = int(xy[:, 1].min())
+
+
+def fix_pagexml(pxml: PageXML, fixes: list[str], options: dict | None = None) -> None:
+    """
+    Applies fixes to a PageXML object in a single traversal of each page.
+    Fixes run in order of registration, not in given order.
+
+    :param pxml: PageXML object, changed in place
+    :param fixes: names of registered fixes
+    :param options: keyword arguments passed to the fixes
+    :return: None
+    """
+    if unknown := set(fixes) - set(FIXES):
+        raise ValueError(f'Unknown fix: {", ".join(sorted(unknown))}')
+    selected = [fix(**(options or {})) for name, fix in FIXES.items() if name in fixes]
+    for page in pxml:
+        ctx = PageContext(page)
+        with stage('transform'):
+            for fix in selected:
+                fix.begin_page(ctx)
+            for region in get_page_regions(page):
+                for fix in selected:
+                    fix.region(region, ctx)
+            for fix in selected:
+                fix.end_page(ctx)
+        with stage('serialize'):
+            ctx.flush()
 
 
 class PageFix:
     def __init__(self, in_fp: Path, out_fp: Path):
-        self._pxml = PageXML.from_xml(in_fp)
+        with stage('parse'):
+            self._pxml = PageXML.from_xml(in_fp)
         self._out_fp = out_fp
+        count('files')
+
+    def apply(self, fixes: list[str], options: dict | None = None) -> None:
+        """
+        Applies fixes in a single traversal of each page. Fixes run in order of registration, not in given order.
+
+        :param fixes: names of registered fixes
+        :param options: keyword arguments passed to the fixes
+        :return: None
+        """
+        fix_pagexml(self._pxml, fixes, options)
 
     def set_relative_image_filename(self):
         """
         Updates imageFilename attribute of each page element from absolute to filename
         """
-        for page in self._pxml:
-            page['imageFilename'] = Path(page['imageFilename']).name
+        self.apply(['filename'])
 
     def merge_regions(self):
         """
         Merge all regions with same region coordinates
         """
-        for page in self._pxml:
-            found_regions: dict[str, Element] = {}
-            for region in get_page_regions(page):
-                coords = get_coords(region).to_page_coords()
-                if coords in found_regions:
-                    for element in region:
-                        found_regions[coords].add_element(element)
-                else:
-                    region['id'] = f'r_{len(found_regions):04d}'
-                    found_regions[coords] = region
-                page.remove_element(region)
-            for coords, region in found_regions.items():
-                page.add_element(region)
+        self.apply(['regions'])
 
     def reading_order(self):
         """
         Create reading order element and add regions
         """
-        for page in self._pxml:
-            ro = []
-            for region in get_page_regions(page):
-                ro.append(region['id'])
-            page.reading_order = ro
+        self.apply(['order'])
 
     def region_type(self):
         """
         Updates region type from custom attribute
         """
-        for page in self._pxml:
-            for region in get_page_regions(page):
-                if (custom := region['custom']) is not None:
-                    _type = custom.replace('structure {type:', '')
-                    _type = _type.replace(';}', '')
-                    region['type'] = _type
+        self.apply(['type'])
 
     def negative_coordinates(self):
         """
-        Replace all negative coordinates with zeros
+        Clip coordinates to the image, replaces negative coordinates with zeros
         """
-        for page in self._pxml:
-            for region in get_page_regions(page):
-                coords = get_coords(region)
-                for point in coords:
-                    if point.x < 0:
-                        point.x = 0
-                    if point.y < 0:
-                        point.y = 0
-                get_coords_element(region)['points'] = coords.to_page_coords()
+        self.apply(['coords'])
 
     def line_order(self):
         """
         Sort all lines of each region by its y coordinates
         """
-        for page in self._pxml:
-            for region in get_page_regions(page):
-                region.elements.sort(key=lambda e: get_coords(e).center().y)
+        self.apply(['lines'])
 
     def spikes(self):
         """
         Remove spikes from elements coordinates
         """
-        for page in self._pxml:
-            for region in get_page_regions(page):
-                min_y = 0  # min y coordinate of previous text line
-                for element in get_region_elements(region):
-                    if (coords_element := get_coords_element(element)) is not None:
-                        coords = get_coords(element)
-                        for point in coords:
-                            if point.y <= min_y:
-                                point.y = min_y + 1
-                        min_y = min([p.y for p in coords])
-                        coords_element['points'] = coords.to_page_coords()
+        self.apply(['spikes'])
 
     def save(self):
         """
         Save changes
         """
-        self._pxml.to_xml(self._out_fp)
+        with stage('serialize'):
+            self._pxml.to_xml(self._out_fp)
+
+
+def pagefix(in_fp: Path, out_dir: Path | None, fixes: list[str], options: dict | None = None) -> None:
+    """
+    Applies fixes to a single PageXML file and saves it
+
+    :param in_fp: path to PageXML file
+    :param out_dir: output directory, overwrite input file if set to None
+    :param fixes: names of registered fixes
+    :param options: keyword arguments passed to the fixes
+    """
+    pf = PageFix(in_fp, in_fp if out_dir is None else out_dir.joinpath(in_fp.name))
+    pf.apply(fixes, options)
+    pf.save()
+
+
+def pagefix_incremental(item: tuple[Path, dict | None], out_dir: Path | None, fixes: list[str],
+                        options: dict | None = None) -> tuple[str, dict]:
+    """
+    Applies fixes to a single PageXML file, unless input and fixes are unchanged since the last run.
+    The output file is only replaced if its content differs.
+
+    :param item: path to PageXML file and its manifest record of the last run (or None)
+    :param out_dir: output directory, overwrite input file if set to None
+    :param fixes: sorted names of registered fixes
+    :param options: keyword arguments passed to the fixes
+    :return: status (skipped, unchanged or written) and new manifest record
+    """
+    in_fp, record = item
+    out_fp = in_fp if out_dir is None else out_dir.joinpath(in_fp.name)
+    options = options or {}
+    in_hash = file_hash(in_fp)
+    if (record is not None and record['fixes'] == fixes and record.get('options', {}) == options
+            and in_hash in (record['input'], record['output'])
+            and out_fp.exists() and file_hash(out_fp) == record['output']):
+        return 'skipped', record
+
+    tmp_fp = out_fp.with_name(f'.{out_fp.name}.tmp')
+    try:
+        pf = PageFix(in_fp, tmp_fp)
+        pf.apply(fixes, options)
+        pf.save()
+        if out_fp.exists() and filecmp.cmp(tmp_fp, out_fp, shallow=False):
+            status = 'unchanged'
+        else:
+            os.replace(tmp_fp, out_fp)
+            status = 'written'
+    finally:
+        tmp_fp.unlink(missing_ok=True)  # unchanged output or failed fix
+    return status, {'input': in_hash, 'output': file_hash(out_fp), 'fixes': fixes, 'options': options}
 
 
 @click.command('pagefix', short_help='Fix invalid PageXML documents.')
@@ -128,6 +438,28 @@ class PageFix:
     type=click.BOOL,
     default=False
 )
+@click.option(
+    '--merge-threshold',
+    help='Merge overlapping regions instead of regions with identical coordinates, if their overlap is at least '
+         'this value (implies -r).',
+    type=click.FloatRange(min=0, max=1),
+    required=False
+)
+@click.option(
+    '--merge-metric',
+    help='Overlap measure for --merge-threshold: intersection over union, or intersection over area of the '
+         'smaller region.',
+    type=click.Choice(['iou', 'overlap']),
+    default='iou',
+    show_default=True
+)
+@click.option(
+    '-a', '--assign',
+    help='Moves TextLine elements outside of regions into the smallest region containing their center.',
+    is_flag=True,
+    type=click.BOOL,
+    default=False
+)
 @click.option(
     '-o', '--order',
     help='Adding or updating ReadingOrder element.',
@@ -144,7 +476,7 @@ class PageFix:
 )
 @click.option(
     '-c', '--coords',
-    help='Sets all negative coordinates of TextLine elements to 0.',
+    help='Clips coordinates of regions and TextLine elements to the image (negative coordinates to 0).',
     is_flag=True,
     type=click.BOOL,
     default=False
@@ -163,8 +495,30 @@ class PageFix:
     type=click.BOOL,
     default=False
 )
-def pagefix_cli(xmls: str, out_dir: str | None, filename: bool, regions: bool, order: bool, _type: bool,
-                coords: bool, lines: bool, spikes: bool):
+@click.option(
+    '-x', '--fix', 'fix_names',
+    help='Apply a registered fix by name. Can be used multiple times.',
+    type=click.STRING,
+    multiple=True
+)
+@click.option(
+    '-i', '--incremental',
+    help=f'Skip files whose content and selected fixes did not change since the last run (recorded in {MANIFEST}) '
+         f'and only write files whose output differs.',
+    is_flag=True,
+    type=click.BOOL,
+    default=False
+)
+@click.option(
+    '-j', '--jobs',
+    help='Number of worker processes.',
+    type=click.IntRange(min=1),
+    default=1,
+    show_default=True
+)
+def pagefix_cli(xmls: str, out_dir: str | None, filename: bool, regions: bool, merge_threshold: float | None,
+                merge_metric: str, assign: bool, order: bool, _type: bool, coords: bool, lines: bool, spikes: bool,
+                fix_names: tuple[str], incremental: bool, jobs: int):
     """
     Fix invalid PageXML documents.
 
@@ -174,24 +528,50 @@ def pagefix_cli(xmls: str, out_dir: str | None, filename: bool, regions: bool, o
     """
     in_fp = Path(xmls)
     if in_fp.is_dir():
-        files = in_fp.glob('*.xml')
+        files = sorted(in_fp.glob('*.xml'))
     else:
         files = [in_fp]
-    with click.progressbar(files, label='Fixing PageXML', show_pos=True, show_eta=True, show_percent=True) as fs:
-        for file in fs:
-            pf = PageFix(file, file if out_dir is None else Path(out_dir).joinpath(file.name))
-            if filename:
-                pf.set_relative_image_filename()
-            if regions:
-                pf.merge_regions()
-            if order:
-                pf.reading_order()
-            if _type:
-                pf.region_type()
-            if coords:
-                pf.negative_coordinates()
-            if lines:
-                pf.line_order()
-            if spikes:
-                pf.spikes()
-            pf.save()
+    if out_dir is not None:
+        Path(out_dir).mkdir(parents=True, exist_ok=True)
+    fixes = [fix for flag, fix in [
+        (filename, 'filename'),
+        (regions or merge_threshold is not None, 'regions'),
+        (assign, 'assign'),
+        (order, 'order'),
+        (_type, 'type'),
+        (coords, 'coords'),
+        (lines, 'lines'),
+        (spikes, 'spikes'),
+    ] if flag] + list(fix_names)
+    if unknown := set(fixes) - set(FIXES):
+        raise click.BadParameter(f'Unknown fix: {", ".join(sorted(unknown))}', param_hint='--fix')
+    options = {} if merge_threshold is None else {'merge_threshold': merge_threshold, 'merge_metric': merge_metric}
+    out_dir = None if out_dir is None else Path(out_dir)
+    if not incremental:
+        worker = partial(pagefix, out_dir=out_dir, fixes=fixes, options=options)
+        failures = [(file.name, error) for file, _, error in
+                    parallel_map(worker, files, jobs=jobs, label='Fixing PageXML') if error is not None]
+        echo_failures(failures)
+        return
+
+    if out_dir is None:
+        out_dir_manifest = in_fp if in_fp.is_dir() else in_fp.parent
+    else:
+        out_dir_manifest = out_dir
+    manifest = Manifest(out_dir_manifest.joinpath(MANIFEST))
+    worker = partial(pagefix_incremental, out_dir=out_dir, fixes=sorted(set(fixes)), options=options)
+    failures = []
+    status_count = {'skipped': 0, 'unchanged': 0, 'written': 0}
+    try:
+        for (file, _), result, error in parallel_map(worker, [(file, manifest.get(file.name)) for file in files],
+                                                     jobs=jobs, label='Fixing PageXML'):
+            if error is not None:
+                failures.append((file.name, error))
+                continue
+            status, record = result
+            status_count[status] += 1
+            manifest.set(file.name, record)
+    finally:
+        manifest.save()
+    click.echo(', '.join(f'{n} {status}' for status, n in status_count.items()))
+    echo_failures(failures)
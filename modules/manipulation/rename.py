@@ -3,11 +3,20 @@ from os import rename as os_rename
 
 import click
 
+from helper.profiling import count, stage
+
+
+def _rename(src: Path, dst: Path) -> None:
+    """ Renames a single file, timed as io stage """
+    with stage('io'):
+        os_rename(src, dst)
+    count('files')
+
 
 def replace(files: list[Path], f: str, t: str = ''):
     with click.progressbar(files, label='Renaming files', show_pos=True, show_eta=True, show_percent=True) as file_list:
         for file in file_list:
-            os_rename(file, file.parent.joinpath(file.name.replace(f, t)))
+            _rename(file, file.parent.joinpath(file.name.replace(f, t)))
 
 
 def dots(files: list[Path], f: str = '_', k: int = 1):
@@ -15,7 +24,7 @@ def dots(files: list[Path], f: str = '_', k: int = 1):
         for file in file_list:
             parts = file.name.split('.')
             k = min(k, len(parts) - 1)
-            os_rename(file, file.parent.joinpath(f'{f.join(parts[0:-k])}.{".".join(parts[-k:])}'))
+            _rename(file, file.parent.joinpath(f'{f.join(parts[0:-k])}.{".".join(parts[-k:])}'))
 
 
 def enum(files: list[Path], o: Path):
@@ -23,21 +32,21 @@ def enum(files: list[Path], o: Path):
     with click.progressbar(files, label='Renaming files', show_pos=True, show_eta=True, show_percent=True) as file_list:
         for i, file in enumerate(file_list):
             map_list.append((file.name, f'{i + 1:05d}.{".".join(file.name.split(".")[1:])}'))
-            os_rename(file, file.parent.joinpath(f'{i + 1:05d}.{".".join(file.name.split(".")[1:])}'))
-    with open(o.joinpath('mapping.txt'), 'w') as f:
+            _rename(file, file.parent.joinpath(f'{i + 1:05d}.{".".join(file.name.split(".")[1:])}'))
+    with stage('serialize'), open(o.joinpath('mapping.txt'), 'w') as f:
         for item in map_list:
             f.write(f'{item[0]} -> {item[1]}\n')
 
 
 def mapping(files: Path, m: Path):
-    with open(m, 'r') as f:
+    with stage('parse'), open(m, 'r') as f:
         map_list = f.readlines()
     with click.progressbar(map_list, label='Renaming files', show_pos=True, show_eta=True, show_percent=True) as maps:
         for line in maps:
             original, mapped = line.split(' -> ')
             original = original.strip()
             mapped = mapped.strip()
-            os_rename(files.joinpath(mapped), files.joinpath(original))
+            _rename(files.joinpath(mapped), files.joinpath(original))
 
 
 @click.command('rename', short_help='Rename a set of files.')
@@ -1,10 +1,17 @@
-from pathlib import Path
 import json
+import sqlite3
+import tempfile
+from functools import partial
+from pathlib import Path
+from typing import Iterator
 
 import click
 
 from pagexml import PageXML, ElementType
 from helper.geometry import Polygon
+from helper.parallel import parallel_map, echo_failures
+from helper.profiling import count, stage
+from helper.stream import iter_json_arrays
 
 
 DEFAULT_MAPPING = Path(__file__).parent.parent.parent.joinpath('configs', 'coco_mapping.json')
@@ -16,69 +23,220 @@ def replace_dots(orig: str) -> str:
     return f'{"_".join(parts[:-1])}.{parts[-1]}'
 
 
-def coco2page(coco_fp: Path, out_dir: Path, mapping: dict, creator: str, dots: bool):
+def image_record(image: dict, dots: bool) -> dict:
+    """ Creates image record of a COCO image, regions are added by the loader """
+    return {
+        'file': replace_dots(image['file_name']) if dots else image['file_name'],
+        'width': image['width'],
+        'height': image['height'],
+        'regions': []
+    }
+
+
+def region_record(region: dict, categories: dict) -> dict:
+    """ Creates region record of a COCO annotation """
+    return {
+        'id': region['id'],
+        'category': categories[region['category_id']],
+        'bbox': [] if len(region['bbox']) < 1 else region['bbox'],
+        'coords': [] if len(region['segmentation']) < 1 else region['segmentation'][0]
+    }
+
+
+def load_coco(coco_fp: Path, dots: bool) -> tuple[list[dict], list[int]]:
     """
-    Parses Coco annotations to valid PageXML files, using pagexml library
+    Loads a COCO file into memory and groups annotations by image
 
     :param coco_fp: path to coco file
-    :param out_dir: directory for generated PageXML files, same as coco file if not set
-    :param mapping: dictionary containing mapping from coco annotations to PageXML regions and elements
-    :param creator: creator saved in metadata
-    :param dots: Remove dots in PageXML file names and all filename attributes. Replace them with underscores
-    :return: None
+    :param dots: Remove dots in file names
+    :return: list of image records (in file order) and ids of annotations without matching image
     """
-    click.echo('Loading COCO File.')
     with open(coco_fp, 'r') as f:
         stream = json.load(f)
-    
+
     categories = {category['id']: category['name'] for category in stream['categories']}
 
     images = {}
     for image in stream['images']:
-        images[image['id']] = {
-            'file': replace_dots(image['file_name']) if dots else image['file_name'],
-            'width': image['width'],
-            'height': image['height'],
-            'regions': []
-        }
+        images[image['id']] = image_record(image, dots)
 
+    unmatched = []
     for region in stream['annotations']:
         if region['image_id'] in images:
-            images[region['image_id']]['regions'].append({
-                'id': region['id'],
-                'category': categories[region['category_id']],
-                'bbox': [] if len(region['bbox']) < 1 else region['bbox'],
-                'coords': [] if len(region['segmentation']) < 1 else region['segmentation'][0]
-            })
+            images[region['image_id']]['regions'].append(region_record(region, categories))
+        else:
+            unmatched.append(region['id'])
+    return list(images.values()), unmatched
+
+
+class CocoSpill:
+    def __init__(self, coco_fp: Path, dots: bool, tmp_dir: Path | None = None):
+        """
+        Streams a COCO file in a single pass and spills images and annotations to a temporary SQLite database,
+        so that annotations can be grouped by image in constant memory.
+
+        :param coco_fp: path to coco file
+        :param dots: Remove dots in file names
+        :param tmp_dir: directory for the temporary database, system default if set to None
+        """
+        self.__tmp = tempfile.TemporaryDirectory(dir=tmp_dir, prefix='coco2page_')
+        self.__con = sqlite3.connect(Path(self.__tmp.name).joinpath('coco.sqlite').as_posix())
+        self.__con.executescript("""
+            PRAGMA journal_mode = OFF;
+            PRAGMA synchronous = OFF;
+            CREATE TABLE images (seq INTEGER PRIMARY KEY, id, record TEXT NOT NULL);
+            CREATE TABLE annotations (seq INTEGER PRIMARY KEY, id, image_id, category_id, region TEXT NOT NULL);
+        """)
+        self.categories: dict = {}
+        with self.__con:
+            for key, value in iter_json_arrays(coco_fp):
+                if key == 'images':
+                    self.__con.execute('INSERT INTO images(id, record) VALUES (?, ?)',
+                                       (value['id'], json.dumps(image_record(value, dots))))
+                elif key == 'annotations':
+                    self.__con.execute(
+                        'INSERT INTO annotations(id, image_id, category_id, region) VALUES (?, ?, ?, ?)',
+                        (value['id'], value['image_id'], value['category_id'], json.dumps({
+                            'id': value['id'],
+                            'bbox': value['bbox'],
+                            'segmentation': value['segmentation'],
+                        })))
+                elif key == 'categories':
+                    self.categories[value['id']] = value['name']
+        self.__con.executescript("""
+            CREATE INDEX images_id ON images(id);
+            CREATE INDEX annotations_image ON annotations(image_id, seq);
+        """)
+
+    def __len__(self) -> int:
+        """ Number of images """
+        return self.__con.execute('SELECT COUNT(*) FROM images').fetchone()[0]
+
+    def __iter__(self) -> Iterator[dict]:
+        """ Yields image records with their regions, in file order """
+        for image_id, record in self.__con.execute('SELECT id, record FROM images ORDER BY seq'):
+            record = json.loads(record)
+            for category_id, region in self.__con.execute(
+                    'SELECT category_id, region FROM annotations WHERE image_id = ? ORDER BY seq', (image_id,)):
+                region = json.loads(region)
+                region['category_id'] = category_id
+                record['regions'].append(region_record(region, self.categories))
+            yield record
+
+    def unmatched(self, limit: int = -1) -> tuple[int, list[int]]:
+        """ Returns number of annotations without matching image and their first ids (all if limit < 0) """
+        query = 'FROM annotations WHERE image_id NOT IN (SELECT id FROM images)'
+        total = self.__con.execute(f'SELECT COUNT(*) {query}').fetchone()[0]
+        return total, [row[0] for row in self.__con.execute(f'SELECT id {query} ORDER BY seq LIMIT ?', (limit,))]
+
+    def close(self) -> None:
+        """ Closes and removes the temporary database """
+        self.__con.close()
+        self.__tmp.cleanup()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+
+def page_filename(file: dict) -> str:
+    """ Returns PageXML file name of an image record """
+    return '.'.join(file['file'].split('.')[:-1]) + '.xml'
+
+
+def create_pagexml(file: dict, mapping: dict, creator: str) -> PageXML:
+    """
+    Builds a PageXML object from an image record
+
+    :param file: image record with regions
+    :param mapping: dictionary containing mapping from coco annotations to PageXML regions and elements
+    :param creator: creator saved in metadata
+    :return: PageXML object
+    """
+    with stage('transform'):
+        pxml = PageXML.new(creator=creator)
+
+        p = pxml.create_page(**{
+            'imageFilename': file['file'],
+            'imageWidth': str(file['width']),
+            'imageHeight': str(file['height']),
+        })
+
+        for rid, region in enumerate(file['regions']):
+            attributes = {} if region['category'] not in mapping else dict(mapping[region['category']]['attributes'])
+            attributes['id'] = f'r_{rid}'
+            r = p.create_element(
+                etype=ElementType.UnknownRegion if region['category'] not in mapping else ElementType(mapping[region['category']]['type']),
+                **attributes
+            )
+            if len(region['coords']) > 0:
+                coords = Polygon.from_coco(region['coords'])
+                r.create_element(ElementType.Coords, points=coords.to_page_coords())
+                count('vertices', len(coords))
+            elif len(region['bbox']) > 0:
+                bbox = Polygon.from_bbox(region['bbox'])
+                r.create_element(ElementType.Coords, points=bbox.to_page_coords())
+                count('vertices', len(bbox))
+        count('elements', len(file['regions']))
+    return pxml
+
+
+def build_page(file: dict, out_dir: Path, mapping: dict, creator: str) -> None:
+    """
+    Builds and saves a PageXML file from an image record
+
+    :param file: image record with regions
+    :param out_dir: directory for generated PageXML files
+    :param mapping: dictionary containing mapping from coco annotations to PageXML regions and elements
+    :param creator: creator saved in metadata
+    :return: None
+    """
+    pxml = create_pagexml(file, mapping, creator)
+    with stage('serialize'):
+        pxml.to_xml(out_dir.joinpath(page_filename(file)))
+    count('files')
+
+
+def coco2page(coco_fp: Path, out_dir: Path, mapping: dict, creator: str, dots: bool, stream: bool = False,
+              jobs: int = 1, threads: bool = False):
+    """
+    Parses Coco annotations to valid PageXML files, using pagexml library
+
+    :param coco_fp: path to coco file
+    :param out_dir: directory for generated PageXML files, same as coco file if not set
+    :param mapping: dictionary containing mapping from coco annotations to PageXML regions and elements
+    :param creator: creator saved in metadata
+    :param dots: Remove dots in PageXML file names and all filename attributes. Replace them with underscores
+    :param stream: parse COCO file incrementally and group annotations on disk instead of in memory
+    :param jobs: number of worker processes building and writing PageXML files
+    :param threads: use worker threads instead of processes
+    :return: None
+    """
+    click.echo('Loading COCO File.')
+    with stage('parse'):
+        if stream:
+            spill = CocoSpill(coco_fp, dots, tmp_dir=out_dir)
+            images, (unmatched_count, unmatched) = spill, spill.unmatched(limit=10)
         else:
-            click.echo(f'! Region {region["id"]} does not match any image file')
+            spill = None
+            images, unmatched = load_coco(coco_fp, dots)
+            unmatched_count = len(unmatched)
     click.echo('Done.')
+    if unmatched_count:
+        ids = ', '.join(map(str, unmatched[:10])) + (', ...' if unmatched_count > 10 else '')
+        click.echo(f'! {unmatched_count} regions do not match any image file ({ids})')
 
-    with click.progressbar(images.values(), label='Building PageXML', show_pos=True, item_show_func=lambda x: x['file'] if x is not None else "", show_eta=True, show_percent=True) as data:
-        for i, file in enumerate(data):
-            
-            pxml = PageXML.new(creator=creator)
-
-            p = pxml.create_page(**{
-                'imageFilename': file['file'],
-                'imageWidth': str(file['width']),
-                'imageHeight': str(file['height']),
-            })
-
-            for rid, region in enumerate(file['regions']):
-                attributes = {} if region['category'] not in mapping else mapping[region['category']]['attributes']
-                attributes['id'] = f'r_{rid}'
-                r = p.create_element(
-                    etype=ElementType.UnknownRegion if region['category'] not in mapping else ElementType(mapping[region['category']]['type']),
-                    **attributes
-                )
-                if len(region['coords']) > 0:
-                    coords = Polygon.from_coco(region['coords'])
-                    r.create_element(ElementType.Coords, points=coords.to_page_coords())
-                elif len(region['bbox']) > 0:
-                    bbox = Polygon.from_bbox(region['bbox'])
-                    r.create_element(ElementType.Coords, points=bbox.to_page_coords())
-            pxml.to_xml(out_dir.joinpath('.'.join(file['file'].split('.')[:-1]) + '.xml'))
+    worker = partial(build_page, out_dir=out_dir, mapping=mapping, creator=creator)
+    try:
+        failures = [(file['file'], error) for file, _, error in
+                    parallel_map(worker, images, jobs=jobs, label='Building PageXML', threads=threads,
+                                 length=len(images)) if error is not None]
+    finally:
+        if spill is not None:
+            spill.close()
+    echo_failures(failures)
 
 
 @click.command('coco2page', short_help='Converts COCO annotations to PageXML files.')
@@ -117,7 +275,31 @@ def coco2page(coco_fp: Path, out_dir: Path, mapping: dict, creator: str, dots: b
     required=False,
     default=False
 )
-def coco2page_cli(coco_file: str, output: str | None, mapping: str | None, creator: str | None, dots: bool):
+@click.option(
+    '-s', '--stream',
+    help='Parse COCO file incrementally and group annotations in a temporary database. Use for very large files.',
+    type=click.BOOL,
+    is_flag=True,
+    required=False,
+    default=False
+)
+@click.option(
+    '-j', '--jobs',
+    help='Number of workers building and writing PageXML files.',
+    type=click.IntRange(min=1),
+    default=1,
+    show_default=True
+)
+@click.option(
+    '-t', '--threads',
+    help='Use worker threads instead of processes.',
+    type=click.BOOL,
+    is_flag=True,
+    required=False,
+    default=False
+)
+def coco2page_cli(coco_file: str, output: str | None, mapping: str | None, creator: str | None, dots: bool,
+                  stream: bool, jobs: int, threads: bool):
     """
     Converts COCO annotations to PageXML files.
     """
@@ -130,4 +312,4 @@ def coco2page_cli(coco_file: str, output: str | None, mapping: str | None, creat
     with open(mapping_fp, 'r') as f:
         mapping = dict(json.load(f))
 
-    coco2page(coco_fp, out_dir, mapping, creator, dots)
+    coco2page(coco_fp, out_dir, mapping, creator, dots, stream, jobs, threads)
@@ -1,24 +1,64 @@
 import csv
+import gzip
+from contextlib import ExitStack
 from pathlib import Path
+from typing import TextIO
 
 import click
 
+from helper.profiling import count, stage
 
-def csv2txt(csv_fp: Path, txt_fp: Path, column: int, skip: bool = False) -> None:
-    cells = []
-    with open(csv_fp.as_posix(), 'r', encoding='utf-8') as f:
-        stream = csv.reader(f, delimiter=',')
-        for row in stream:
-            if row[column]:
-                cells.append(row[column])
-            elif not skip:
-                cells.append('')
+GZIP_MAGIC = b'\x1f\x8b'
 
-    with open(txt_fp.as_posix(), 'w', encoding='utf-8') as f:
-        f.write('\n'.join(cells))
 
+def open_csv(fp: Path) -> TextIO:
+    """ Opens a CSV file for reading, gzip compressed files are detected by their suffix or magic number """
+    with open(fp, 'rb') as f:
+        compressed = fp.suffix.lower() == '.gz' or f.read(2) == GZIP_MAGIC
+    if compressed:
+        return gzip.open(fp, 'rt', encoding='utf-8', newline='')
+    return open(fp, 'r', encoding='utf-8', newline='')
 
-@click.command('csv2txt', short_help='Extracts a column from a CSV file into a TXT file.')
+
+def output_paths(txt_fp: Path, columns: list[int]) -> list[Path]:
+    """ Returns output file of each column, txt_fp for a single column, else txt_fp with column number appended """
+    if len(columns) == 1:
+        return [txt_fp]
+    return [txt_fp.with_name(f'{txt_fp.stem}_{column}{txt_fp.suffix}') for column in columns]
+
+
+def csv2txt(csv_fp: Path, txt_fp: Path, columns: int | list[int], skip: bool = False) -> list[Path]:
+    """
+    Extracts columns of a (gzip compressed) CSV file into text files, one line per row.
+    Rows are streamed, memory does not depend on the size of the file.
+
+    :param csv_fp: input CSV file
+    :param txt_fp: output text file, with column number appended to the file name if multiple columns are extracted
+    :param columns: column or list of columns to extract
+    :param skip: skip empty cells, else insert blank line. Rows without the column count as empty cells.
+    :return: list of output files
+    """
+    columns = list(dict.fromkeys([columns] if isinstance(columns, int) else columns))
+    paths = output_paths(txt_fp, columns)
+    with ExitStack() as stack:
+        f = stack.enter_context(open_csv(csv_fp))
+        outputs = [stack.enter_context(open(fp.as_posix(), 'w', encoding='utf-8')) for fp in paths]
+        separators = [''] * len(columns)  # lines are joined by newlines, no newline after the last one
+        rows = 0
+        with stage('parse'):  # reading, parsing and writing are interleaved
+            for row in csv.reader(f, delimiter=','):
+                rows += 1
+                for i, column in enumerate(columns):
+                    cell = row[column] if -len(row) <= column < len(row) else ''
+                    if cell or not skip:
+                        outputs[i].write(separators[i] + cell)
+                        separators[i] = '\n'
+    count('rows', rows)
+    count('files', len(paths))
+    return paths
+
+
+@click.command('csv2txt', short_help='Extracts columns from a CSV file into TXT files.')
 @click.help_option('--help', '-h')
 @click.argument(
     'csv_in',
@@ -32,9 +72,11 @@ def csv2txt(csv_fp: Path, txt_fp: Path, column: int, skip: bool = False) -> None
 )
 @click.option(
     '-c', '--column',
-    help='Column to extract.',
+    help='Column to extract. Can be used multiple times, each column is written to TXT_OUT with the column '
+         'number appended to the file name.',
     type=int,
-    default=0,
+    multiple=True,
+    default=[0],
     show_default=True,
     required=False
 )
@@ -45,15 +87,16 @@ def csv2txt(csv_fp: Path, txt_fp: Path, column: int, skip: bool = False) -> None
     type=bool,
     default=False
 )
-def csv2txt_cli(csv_in: str, txt_out: str, column: int, skip: bool) -> None:
+def csv2txt_cli(csv_in: str, txt_out: str, column: tuple[int], skip: bool) -> None:
     """
     Extracts a column from a .csv file into a .txt file.
 
+    CSV_IN can be gzip compressed.
+
     TXT_OUT of format '/path/to/file.txt'.
 
     Made for pagesearch script.
     """
     click.echo('Extracting content...', nl=False)
-    csv2txt(Path(csv_in), Path(txt_out), column, skip)
+    csv2txt(Path(csv_in), Path(txt_out), list(column), skip)
     click.echo(' Done')
-    
\ No newline at end of file
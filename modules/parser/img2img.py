@@ -1,10 +1,74 @@
+from functools import partial
 from pathlib import Path
 
 import click
 from PIL import Image
 
+from helper.parallel import parallel_map, echo_failures
+from helper.profiling import count, stage
 
-def img2img(images: Path, out_dir: Path, in_suffix: str, out_suffix: str, height: int | None):
+RESAMPLING = {
+    'lanczos': Image.Resampling.LANCZOS,
+    'bicubic': Image.Resampling.BICUBIC,
+    'hamming': Image.Resampling.HAMMING,
+    'bilinear': Image.Resampling.BILINEAR,
+    'box': Image.Resampling.BOX,
+    'nearest': Image.Resampling.NEAREST,
+}
+REDUCING_GAP = 3.0  # fast mode: reduce by integer factor while the image is larger than 3x the target size
+
+
+def resize_image(img: Image.Image, height: int, resample: str = 'lanczos', fast: bool = False,
+                 width: int | None = None) -> Image.Image:
+    """
+    Resizes an image to a height, keeping the aspect ratio
+
+    :param img: image
+    :param height: new height in pixels
+    :param resample: name of resampling filter, see RESAMPLING
+    :param fast: reduce by an integer factor before resampling
+    :param width: new width in pixels, computed from the aspect ratio of img if set to None
+    :return: resized image
+    """
+    new_width = int(height * img.width / img.height) if width is None else width
+    with stage('transform'):
+        if fast:
+            return img.resize((new_width, height), RESAMPLING[resample], reducing_gap=REDUCING_GAP)
+        return img.resize((new_width, height), RESAMPLING[resample])
+
+
+def convert_image(image: Path, out_dir: Path, in_suffix: str, out_suffix: str, height: int | None,
+                  resample: str = 'lanczos', fast: bool = False):
+    """
+    Converts a single image file
+
+    :param image: path to image file
+    :param out_dir: Directory for output files
+    :param in_suffix: suffix of input file, replaced by out_suffix
+    :param out_suffix: suffix of output file, starting with .
+    :param height: Height of converted file in pixels, keep original height if set to None
+    :param resample: name of resampling filter, see RESAMPLING
+    :param fast: decode JPEG files at reduced scale (draft mode) and reduce by an integer factor before resampling
+    """
+    out_path = out_dir.joinpath(f'{image.name.replace(in_suffix, out_suffix)}')
+    with Image.open(image) as img:
+        if height is not None:
+            original_width, original_height = img.size
+            aspect_ratio = original_width / original_height
+            new_width = int(height * aspect_ratio)
+            if fast:
+                img.draft(img.mode, (new_width, height))  # only JPEG, decoded size stays >= requested size
+            with stage('parse'):
+                img.load()
+            count('pixels', img.width * img.height)
+            img = resize_image(img, height, resample, fast, new_width)
+        with stage('serialize'):
+            img.save(out_path)
+    count('files')
+
+
+def img2img(images: Path, out_dir: Path, in_suffix: str, out_suffix: str, height: int | None, jobs: int = 1,
+            resample: str = 'lanczos', fast: bool = False):
     """
     Converts image files of type in_suffix to out_suffix
 
@@ -13,22 +77,22 @@ def img2img(images: Path, out_dir: Path, in_suffix: str, out_suffix: str, height
     :param in_suffix: suffix of input files, starting with ., ignored if IMAGES points to a file
     :param out_suffix: suffix of output files, starting with .
     :param height: Height of converted files in pixels, keep original height if set to None
+    :param jobs: Number of worker threads. At most 2 * jobs images are in memory at the same time
+    :param resample: name of resampling filter, see RESAMPLING
+    :param fast: faster downscaling with draft mode decoding and integer reduction, see convert_image
     """
     out_dir.mkdir(exist_ok=True, parents=True)
     if images.is_dir():
         img_list = sorted(list(images.glob(f'*{in_suffix}')))
     else:
         img_list = [images]
-    with click.progressbar(img_list, label='Convert images', show_pos=True, show_eta=True, show_percent=True) as imgs:
-        for image in imgs:
-            out_path = out_dir.joinpath(f'{image.name.replace(in_suffix, out_suffix)}')
-            img = Image.open(image)
-            if height is not None:
-                original_width, original_height = img.size
-                aspect_ratio = original_width / original_height
-                new_width = int(height * aspect_ratio)
-                img = img.resize((new_width, height), Image.LANCZOS)
-            img.save(out_path)
+    worker = partial(convert_image, out_dir=out_dir, in_suffix=in_suffix, out_suffix=out_suffix, height=height,
+                     resample=resample, fast=fast)
+    # Pillow releases the GIL while decoding, resizing and encoding, so threads scale without pickling images
+    failures = [(image.name, error) for image, _, error in
+                parallel_map(worker, img_list, jobs=jobs, label='Convert images', max_pending=2 * jobs, threads=True)
+                if error is not None]
+    echo_failures(failures, 'images')
 
 
 @click.command('img2img', short_help='Convert image files.')
@@ -63,7 +127,29 @@ def img2img(images: Path, out_dir: Path, in_suffix: str, out_suffix: str, height
     type=int,
     required=False
 )
-def img2img_cli(images: str, out_dir: str, _input: str, output: str, size: int | None):
+@click.option(
+    '-f', '--filter', 'resample',
+    help='Resampling filter for resizing.',
+    type=click.Choice(list(RESAMPLING)),
+    default='lanczos',
+    show_default=True
+)
+@click.option(
+    '--fast',
+    help='Fast downscaling: decode JPEG files at reduced scale and reduce by integer factors before resampling.',
+    is_flag=True,
+    type=bool,
+    default=False
+)
+@click.option(
+    '-j', '--jobs',
+    help='Number of worker threads.',
+    type=click.IntRange(min=1),
+    default=1,
+    show_default=True
+)
+def img2img_cli(images: str, out_dir: str, _input: str, output: str, size: int | None, resample: str, fast: bool,
+                jobs: int):
     """
     Converts image file with INPUT format to OUTPUT format.
     """
@@ -72,5 +158,8 @@ def img2img_cli(images: str, out_dir: str, _input: str, output: str, size: int |
         out_dir=Path(out_dir),
         in_suffix=_input if _input.startswith('.') else f'.{_input}',
         out_suffix=output if output.startswith('.') else f'.{output}',
-        height=size
+        height=size,
+        jobs=jobs,
+        resample=resample,
+        fast=fast
     )
\ No newline at end of file
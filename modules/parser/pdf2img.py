@@ -1,11 +1,145 @@
+import os
+from functools import lru_cache, partial
 from pathlib import Path
 
 import click
 import fitz
 from PIL import Image
 
+from helper.parallel import parallel_map, echo_failures
+from helper.profiling import count, stage
 
-def pdf2img(pdf: Path, out_dir: Path, output: str, height: int | None, dpi: int):
+
+def target_size(page: fitz.Page, height: int, dpi: int) -> tuple[int, int]:
+    """
+    Computes output size of a page, same as rendering at dpi and resizing to height while keeping the aspect ratio
+
+    :param page: pdf page
+    :param height: output image height in pixels
+    :param dpi: pdf scan dpi
+    :return: width, height in pixels
+    """
+    rendered = (page.rect * fitz.Matrix(dpi / 72, dpi / 72)).irect  # size of page.get_pixmap(dpi=dpi)
+    return int(height * rendered.width / rendered.height), height
+
+
+def rasterize(page: fitz.Page, height: int | None, dpi: int) -> tuple[fitz.Pixmap, tuple[int, int]]:
+    """
+    Rasterizes a pdf page. If height is set, the page is rasterized directly at the output size.
+
+    :param page: pdf page
+    :param height: output image height in pixels. Render at dpi if set to None
+    :param dpi: pdf scan dpi
+    :return: pixmap and output size, sizes differ by a pixel if rounding of the page rectangle differs
+    """
+    with stage('transform'):
+        if height is None:
+            pixmap = page.get_pixmap(dpi=dpi)
+            size = pixmap.width, pixmap.height
+        else:
+            size = target_size(page, height, dpi)
+            pixmap = page.get_pixmap(matrix=fitz.Matrix(size[0] / page.rect.width, size[1] / page.rect.height))
+    count('pixels', pixmap.width * pixmap.height)
+    return pixmap, size
+
+
+def pixmap_image(pixmap: fitz.Pixmap) -> Image.Image:
+    """ Converts a pixmap to a Pillow image """
+    return Image.frombytes({1: 'L', 3: 'RGB', 4: 'RGBA'}[pixmap.n], (pixmap.width, pixmap.height), pixmap.samples)
+
+
+def render_image(page: fitz.Page, height: int | None, dpi: int) -> Image.Image:
+    """
+    Renders a pdf page to an image in memory
+
+    :param page: pdf page
+    :param height: output image height in pixels. Render at dpi if set to None
+    :param dpi: pdf scan dpi
+    :return: image
+    """
+    pixmap, size = rasterize(page, height, dpi)
+    img = pixmap_image(pixmap)
+    return img if img.size == size else img.resize(size, Image.LANCZOS)
+
+
+def render_page(page: fitz.Page, outfile: Path, height: int | None, dpi: int) -> None:
+    """
+    Renders a pdf page and saves it as image file.
+    If height is set, the page is rasterized directly at the output size and encoded once.
+
+    :param page: pdf page
+    :param outfile: output image file path
+    :param height: output image height in pixels. Render at dpi if set to None
+    :param dpi: pdf scan dpi
+    """
+    pixmap, size = rasterize(page, height, dpi)
+    with stage('serialize'):
+        if (pixmap.width, pixmap.height) == size:
+            pixmap.save(outfile)
+        else:  # rounding of the page rectangle differs, resample to the exact size in memory
+            pixmap_image(pixmap).resize(size, Image.LANCZOS).save(outfile)
+
+
+def parse_pages(pages: str | None, page_count: int) -> list[int]:
+    """
+    Parses a page selection like '1-10,15,20-' (1-based, inclusive, open ranges allowed)
+
+    :param pages: page selection, all pages if set to None
+    :param page_count: number of pages in the document
+    :return: sorted list of 1-based page numbers
+    :raises click.BadParameter: if the selection is malformed, reversed or out of range
+    """
+    if pages is None:
+        return list(range(1, page_count + 1))
+    selected = set()
+    for part in pages.split(','):
+        if not (part := part.strip()):
+            continue
+        start, sep, end = (x.strip() for x in part.partition('-'))
+        if not all(x.isascii() and x.isdecimal() for x in (start, end) if x) or not (start or end):
+            raise click.BadParameter(f'Invalid page selection {part!r}, use e.g. 1-10,15,20-', param_hint='--pages')
+        start = int(start) if start else 1
+        end = (int(end) if end else page_count) if sep else start
+        if not 1 <= start <= page_count or end > page_count:
+            raise click.BadParameter(f'Page selection {part!r} out of range, document has {page_count} pages',
+                                     param_hint='--pages')
+        if start > end:
+            raise click.BadParameter(f'Reversed page range {part!r}', param_hint='--pages')
+        selected.update(range(start, end + 1))
+    if not selected:
+        raise click.BadParameter(f'Empty page selection {pages!r}', param_hint='--pages')
+    return sorted(selected)
+
+
+@lru_cache(maxsize=4)
+def open_pdf(pdf: Path) -> fitz.Document:
+    """ Opens a pdf file once per process """
+    return fitz.open(pdf)
+
+
+def convert_page(number: int, pdf: Path, out_dir: Path, output: str, height: int | None, dpi: int) -> None:
+    """
+    Renders a single page to out_dir. The image is written to a temporary file first and renamed when complete,
+    so interrupted runs never leave incomplete images behind.
+
+    :param number: 1-based page number
+    :param pdf: input pdf file path
+    :param out_dir: output directory for image files
+    :param output: output image file suffix, starting with '.'
+    :param height: output image height in pixels. Keep original height if set to None
+    :param dpi: pdf scan dpi
+    """
+    outfile = out_dir.joinpath(f'{number:04d}{output}')
+    partfile = out_dir.joinpath(f'{number:04d}.part{output}')
+    with stage('parse'):
+        page = open_pdf(pdf)[number - 1]
+    render_page(page, partfile, height, dpi)
+    os.replace(partfile, outfile)
+    count('files')
+
+
+def pdf2img(pdf: Path, out_dir: Path, output: str, height: int | None, dpi: int, jobs: int = 1,
+            pages: str | None = None, resume: bool = False):
     """
     Converts a pdf file to image files.
 
@@ -14,22 +148,21 @@ def pdf2img(pdf: Path, out_dir: Path, output: str, height: int | None, dpi: int)
     :param output: output image file suffix, starting with '.'
     :param height: output image height in pixels. Keep original height if set to None
     :param dpi: pdf scan dpi
+    :param jobs: number of worker processes, each opens its own document handle
+    :param pages: page selection like '1-10,15,20-', all pages if set to None
+    :param resume: skip pages which already have an output image
     """
     out_dir.mkdir(exist_ok=True, parents=True)
 
-    fs = fitz.open(pdf)
-    with click.progressbar(fs, label='Convert images', show_pos=True, show_eta=True, show_percent=True) as pages:
-        for i, page in enumerate(pages):
-            pixmap = page.get_pixmap(dpi=dpi)
-            outfile = out_dir.joinpath(f'{(i + 1):04d}{output}')
-            pixmap.save(outfile)
-            if height is not None:
-                img = Image.open(outfile)
-                original_width, original_height = img.size
-                aspect_ratio = original_width / original_height
-                new_width = int(height * aspect_ratio)
-                img = img.resize((new_width, height), Image.LANCZOS)
-                img.save(outfile)
+    with fitz.open(pdf) as fs:
+        numbers = parse_pages(pages, fs.page_count)
+    if resume:
+        numbers = [n for n in numbers if not out_dir.joinpath(f'{n:04d}{output}').exists()]
+    worker = partial(convert_page, pdf=pdf, out_dir=out_dir, output=output, height=height, dpi=dpi)
+    failures = [(f'page {number}', error) for number, _, error in
+                parallel_map(worker, numbers, jobs=jobs, label='Convert images') if error is not None]
+    open_pdf.cache_clear()
+    echo_failures(failures, 'pages')
 
 
 @click.command('pdf2img', short_help='Convert PDF file to image files.')
@@ -66,7 +199,28 @@ def pdf2img(pdf: Path, out_dir: Path, output: str, height: int | None, dpi: int)
     default=300,
     show_default=True
 )
-def pdf2img_cli(pdf: str, out_dir: str, output: str, size: int | None, dpi: int):
+@click.option(
+    '-p', '--pages',
+    help='Pages to convert, e.g. "1-10,15,20-". Defaults to all pages.',
+    type=click.STRING,
+    required=False
+)
+@click.option(
+    '-r', '--resume',
+    help='Skip pages which were already converted.',
+    is_flag=True,
+    type=bool,
+    default=False
+)
+@click.option(
+    '-j', '--jobs',
+    help='Number of worker processes.',
+    type=click.IntRange(min=1),
+    default=1,
+    show_default=True
+)
+def pdf2img_cli(pdf: str, out_dir: str, output: str, size: int | None, dpi: int, pages: str | None, resume: bool,
+                jobs: int):
     """
     Converts PDF file to PNG images, numerated by page number.
     """
@@ -75,5 +229,8 @@ def pdf2img_cli(pdf: str, out_dir: str, output: str, size: int | None, dpi: int)
         out_dir=Path(out_dir),
         output=output if output.startswith('.') else f'.{output}',
         height=size,
-        dpi=dpi
+        dpi=dpi,
+        jobs=jobs,
+        pages=pages,
+        resume=resume
     )
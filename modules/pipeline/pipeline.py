@@ -0,0 +1,434 @@
+import csv
+import json
+import queue
+import threading
+from pathlib import Path
+from typing import Any, Iterator
+
+import click
+
+from helper.parallel import echo_failures
+from helper.profiling import count, stage
+
+DONE = object()  # end of stream marker, passed through all queues
+DEFAULT_QUEUE_SIZE = 8
+
+
+class Item:
+    def __init__(self, name: str, pxml: Any = None, image: Any = None):
+        """
+        Single page passed between pipeline stages
+
+        :param name: file name without suffix, relative to the input directory of the source and output directories
+        :param pxml: parsed PageXML object
+        :param image: decoded PIL image
+        """
+        self.name = name
+        self.pxml = pxml
+        self.image = image
+
+
+class PipelineStage:
+    """
+    Base class of pipeline stages. Sources produce items (items), all other stages process one item at a time
+    (process) in their own thread. Modules of the wrapped subcommands are imported when a stage is created.
+    """
+    name = ''
+    source = False
+
+    def __init__(self, base: Path, **config) -> None:
+        """
+        :param base: directory of the recipe, relative paths are resolved against it
+        :param config: stage parameters of the recipe
+        """
+        if config:
+            raise ValueError(f'Unknown parameters: {", ".join(sorted(config))}')
+        self._base = base
+        self.failures: list[tuple[str, str]] = []
+
+    def path(self, value: str) -> Path:
+        """ Resolves a path of the recipe """
+        return self._base.joinpath(value)
+
+    def fail(self, name: str, error: Exception) -> None:
+        """ Records a failed item, the pipeline continues with the next one """
+        self.failures.append((name, f'{self.name}: {type(error).__name__}: {error}'))
+
+    def items(self) -> Iterator[Item]:
+        """ Generates items, sources only """
+        raise NotImplementedError
+
+    def process(self, item: Item) -> Item | None:
+        """ Processes an item, returns None to drop it """
+        return item
+
+    def close(self) -> None:
+        """ Called after the last item """
+
+
+STAGES: dict[str, type[PipelineStage]] = {}
+
+
+def register_stage(pipeline_stage: type[PipelineStage]) -> type[PipelineStage]:
+    """
+    Registers a stage under its name, usable as class decorator
+
+    :param pipeline_stage: PipelineStage subclass with unique name
+    :return: unchanged class
+    """
+    STAGES[pipeline_stage.name] = pipeline_stage
+    return pipeline_stage
+
+
+@register_stage
+class PagesSource(PipelineStage):
+    """ Reads PageXML files of a directory """
+    name = 'pages'
+    source = True
+
+    def __init__(self, base: Path, input: str, glob: str = '*.xml', **config) -> None:
+        super().__init__(base, **config)
+        self._input = self.path(input)
+        self._glob = glob
+
+    def items(self) -> Iterator[Item]:
+        from pagexml import PageXML
+
+        for fp in sorted(self._input.glob(self._glob)):
+            try:
+                with stage('parse'):
+                    pxml = PageXML.from_xml(fp)
+            except Exception as e:
+                self.fail(fp.name, e)
+                continue
+            count('files')
+            yield Item(fp.relative_to(self._input).as_posix().removesuffix('.xml'), pxml=pxml)
+
+
+@register_stage
+class CocoSource(PipelineStage):
+    """ Builds PageXML objects from COCO annotations, see coco2page """
+    name = 'coco2page'
+    source = True
+
+    def __init__(self, base: Path, coco: str, mapping: str | None = None, creator: str = 'ZPD Wuerzburg',
+                 dots: bool = False, stream: bool = False, **config) -> None:
+        from modules.parser.coco2page import DEFAULT_MAPPING
+
+        super().__init__(base, **config)
+        self._coco = self.path(coco)
+        with open(DEFAULT_MAPPING if mapping is None else self.path(mapping), 'r') as f:
+            self._mapping = dict(json.load(f))
+        self._creator = creator
+        self._dots = dots
+        self._stream = stream
+
+    def items(self) -> Iterator[Item]:
+        from modules.parser.coco2page import CocoSpill, load_coco, create_pagexml, page_filename
+
+        spill = None
+        with stage('parse'):
+            if self._stream:
+                spill = images = CocoSpill(self._coco, self._dots)
+                unmatched_count = spill.unmatched()[0]
+            else:
+                images, unmatched = load_coco(self._coco, self._dots)
+                unmatched_count = len(unmatched)
+        if unmatched_count:
+            click.echo(f'! {unmatched_count} regions do not match any image file')
+        try:
+            for file in images:
+                try:
+                    pxml = create_pagexml(file, self._mapping, self._creator)
+                except Exception as e:
+                    self.fail(file['file'], e)
+                    continue
+                yield Item(page_filename(file).removesuffix('.xml'), pxml=pxml)
+        finally:
+            if spill is not None:  # SQLite connections can only be closed by the thread that created them
+                spill.close()
+
+
+@register_stage
+class PdfSource(PipelineStage):
+    """ Renders pages of a PDF file, see pdf2img. Items are named by their page number. """
+    name = 'pdf2img'
+    source = True
+
+    def __init__(self, base: Path, pdf: str, height: int | None = None, dpi: int = 300, pages: str | None = None,
+                 **config) -> None:
+        super().__init__(base, **config)
+        self._pdf = self.path(pdf)
+        self._height = height
+        self._dpi = dpi
+        self._pages = pages
+
+    def items(self) -> Iterator[Item]:
+        import fitz
+        from modules.parser.pdf2img import parse_pages, render_image
+
+        with fitz.open(self._pdf) as doc:
+            for n in parse_pages(self._pages, doc.page_count):
+                try:
+                    with stage('parse'):
+                        page = doc[n - 1]
+                    image = render_image(page, self._height, self._dpi)
+                except Exception as e:
+                    self.fail(f'page {n}', e)
+                    continue
+                yield Item(f'{n:04d}', image=image)
+
+
+@register_stage
+class PageFixStage(PipelineStage):
+    """ Applies fixes to the PageXML object of an item, see pagefix """
+    name = 'pagefix'
+
+    def __init__(self, base: Path, fixes: list[str], options: dict | None = None, **config) -> None:
+        from modules.manipulation.pagefix import FIXES, fix_pagexml
+
+        super().__init__(base, **config)
+        if unknown := set(fixes) - set(FIXES):
+            raise ValueError(f'Unknown fix: {", ".join(sorted(unknown))}')
+        self._fix = fix_pagexml
+        self._fixes = fixes
+        self._options = options or {}
+
+    def process(self, item: Item) -> Item | None:
+        if item.pxml is None:
+            raise ValueError('no PageXML object, add a pages or coco2page source')
+        self._fix(item.pxml, self._fixes, self._options)
+        return item
+
+
+@register_stage
+class ImageStage(PipelineStage):
+    """ Resizes the image of an item, see img2img """
+    name = 'img2img'
+
+    def __init__(self, base: Path, height: int, resample: str = 'lanczos', fast: bool = False, **config) -> None:
+        from modules.parser.img2img import RESAMPLING, resize_image
+
+        super().__init__(base, **config)
+        if resample not in RESAMPLING:
+            raise ValueError(f'Unknown resampling filter: {resample}')
+        self._resize = resize_image
+        self._height = height
+        self._resample = resample
+        self._fast = fast
+
+    def process(self, item: Item) -> Item | None:
+        if item.image is None:
+            raise ValueError('no image, add a pdf2img source')
+        item.image = self._resize(item.image, self._height, self._resample, self._fast)
+        return item
+
+
+@register_stage
+class SaveStage(PipelineStage):
+    """ Writes PageXML object and image of an item to an output directory """
+    name = 'save'
+
+    def __init__(self, base: Path, output: str, image_suffix: str = '.png', **config) -> None:
+        super().__init__(base, **config)
+        self._output = self.path(output)
+        self._output.mkdir(parents=True, exist_ok=True)
+        self._image_suffix = image_suffix
+
+    def process(self, item: Item) -> Item | None:
+        self._output.joinpath(item.name).parent.mkdir(parents=True, exist_ok=True)  # recursive glob of pages source
+        if item.pxml is not None:
+            with stage('serialize'):
+                item.pxml.to_xml(self._output.joinpath(f'{item.name}.xml'))
+        if item.image is not None:
+            with stage('serialize'):
+                item.image.save(self._output.joinpath(f'{item.name}{self._image_suffix}'))
+        count('files')
+        return item
+
+
+@register_stage
+class SearchStage(PipelineStage):
+    """
+    Searches text lines of the PageXML object of an item, see pagesearch. Results are written to a CSV file with
+    the same columns and values as pagesearch: files with hits are numbered, original files are relative to the
+    input directory and without suffix.
+    """
+    name = 'pagesearch'
+
+    def __init__(self, base: Path, search: str, output: str, regex: bool = False, normalize: str | None = None,
+                 casefold: bool = False, **config) -> None:
+        from helper.search import compile_matcher
+        from modules.analyse.pagesearch import CSV_HEADER, parse_search
+
+        super().__init__(base, **config)
+        if not (patterns := parse_search(self.path(search))):
+            raise ValueError('Search empty!')
+        self._matcher = compile_matcher(patterns, regex=regex, normalize=normalize, casefold=casefold)
+        fp = self.path(output)
+        fp.parent.mkdir(parents=True, exist_ok=True)
+        self._f = open(fp, 'w', encoding='utf-8', newline='')
+        self._writer = csv.writer(self._f)
+        self._writer.writerow(CSV_HEADER)
+        self._files = 0  # file counter, only files with hits
+
+    def process(self, item: Item) -> Item | None:
+        from helper.page import iter_page_lines
+        from helper.stream import number_lines
+        from modules.analyse.pagesearch import match_lines
+
+        if item.pxml is None:
+            raise ValueError('no PageXML object, add a pages or coco2page source')
+        with stage('search'):
+            hits = match_lines(number_lines(iter_page_lines(item.pxml)), self._matcher)
+        if hits:
+            self._files += 1
+            self._writer.writerows([hit['search'], f'{self._files:05d}', hit['line'], hit['text'], item.name]
+                                   for hit in hits)
+        return item
+
+    def close(self) -> None:
+        self._f.close()
+
+
+def load_recipe(fp: Path) -> dict:
+    """
+    Loads a recipe file, YAML if the suffix is .yml or .yaml (requires PyYAML), JSON otherwise
+
+    :param fp: recipe file
+    :return: recipe with list of stages
+    """
+    with open(fp, 'r', encoding='utf-8') as f:
+        if fp.suffix.lower() not in ('.yml', '.yaml'):
+            return json.load(f)
+        try:
+            import yaml
+        except ImportError:
+            raise click.UsageError('YAML recipes require PyYAML (pip install pyyaml), use a JSON recipe instead.')
+        return yaml.safe_load(f)
+
+
+def build_stages(recipe: dict, base: Path) -> list[PipelineStage]:
+    """
+    Creates the stages of a recipe. The first stage has to be a source, all others must not be.
+
+    :param recipe: recipe with list of stages, each a dict with stage name and its parameters
+    :param base: directory of the recipe, relative paths are resolved against it
+    :return: list of stages
+    """
+    stages = []
+    for n, config in enumerate(recipe.get('stages', [])):
+        config = dict(config)
+        name = config.pop('stage', None)
+        if name not in STAGES:
+            raise click.UsageError(f'Unknown stage {name} (available: {", ".join(STAGES)})')
+        if STAGES[name].source != (n == 0):
+            raise click.UsageError(f'Stage {name}: ' + ('only the first stage can be a source' if n else
+                                                        'first stage has to be a source'))
+        try:
+            stages.append(STAGES[name](base, **config))
+        except (TypeError, ValueError) as e:
+            raise click.UsageError(f'Stage {name}: {e}')
+    if not stages:
+        raise click.UsageError('Recipe has no stages.')
+    return stages
+
+
+def run_pipeline(stages: list[PipelineStage], queue_size: int = DEFAULT_QUEUE_SIZE) -> tuple[int, list]:
+    """
+    Runs stages in one thread each, connected by bounded queues. Stages overlap while parsing, image decoding and
+    writing release the GIL, the queues limit the number of pages held in memory. Failed items are dropped and
+    reported, the pipeline continues with the next item.
+
+    :param stages: source followed by processing stages
+    :param queue_size: maximum number of items waiting in front of each stage
+    :return: number of items that passed all stages and list of (item, error message) tuples
+    """
+    queues = [queue.Queue(maxsize=queue_size) for _ in stages[1:]]
+    abort = threading.Event()
+    errors = []
+    passed = 0
+
+    def produce(source: PipelineStage, out: queue.Queue | None) -> None:
+        nonlocal passed
+        try:
+            for item in source.items():
+                if abort.is_set():
+                    break
+                if out is None:
+                    passed += 1
+                else:
+                    out.put(item)
+        except Exception as e:
+            errors.append(e)
+            abort.set()
+        finally:
+            if out is not None:
+                out.put(DONE)
+
+    def consume(current: PipelineStage, inp: queue.Queue, out: queue.Queue | None) -> None:
+        nonlocal passed
+        # always drain the input until DONE, so upstream stages never block on a full queue
+        while (item := inp.get()) is not DONE:
+            if abort.is_set():
+                continue
+            try:
+                item = current.process(item)
+            except Exception as e:
+                current.fail(item.name, e)
+                continue
+            if item is None:
+                continue
+            if out is None:
+                passed += 1
+            else:
+                out.put(item)
+        if out is not None:
+            out.put(DONE)
+
+    threads = [threading.Thread(target=produce, args=(stages[0], queues[0] if queues else None),
+                                name=stages[0].name)]
+    for n, current in enumerate(stages[1:]):
+        threads.append(threading.Thread(target=consume, args=(current, queues[n], queues[n + 1]
+                                        if n + 1 < len(queues) else None), name=current.name))
+    try:
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+    finally:
+        for current in stages:
+            current.close()
+    if errors:
+        raise errors[0]
+    return passed, [failure for current in stages for failure in current.failures]
+
+
+@click.command('pipeline', short_help='Run subcommands as stages of a single pipeline.')
+@click.help_option('--help', '-h')
+@click.argument(
+    'recipe',
+    type=click.Path(exists=True, dir_okay=False, file_okay=True),
+    required=True
+)
+@click.option(
+    '-q', '--queue-size',
+    help='Maximum number of pages waiting in front of each stage. Overrides queue_size of the recipe.',
+    type=click.IntRange(min=1),
+    required=False
+)
+def pipeline_cli(recipe: str, queue_size: int | None):
+    """
+    Run subcommands as stages of a single pipeline.
+
+    RECIPE is a JSON (or YAML) file with a list of stages. Pages are passed between stages in memory,
+    each page is parsed and written once per pipeline.
+
+    Sources: pages, coco2page, pdf2img. Stages: pagefix, img2img, save, pagesearch.
+    """
+    recipe_fp = Path(recipe)
+    config = load_recipe(recipe_fp)
+    stages = build_stages(config, recipe_fp.parent)
+    passed, failures = run_pipeline(stages, queue_size or config.get('queue_size', DEFAULT_QUEUE_SIZE))
+    echo_failures(failures, 'pages')
+    click.echo(f'Done! ({passed} pages)')
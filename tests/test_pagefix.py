@@ -0,0 +1,38 @@
+import pytest
+
+pytest.importorskip('pagexml')
+
+from pagexml import PageXML, ElementType
+
+from modules.manipulation.pagefix import fix_pagexml
+
+PAGE = """<?xml version="1.0" encoding="UTF-8"?>
+<PcGts xmlns="http://schema.primaresearch.org/PAGE/gts/pagecontent/2019-07-15">
+  <Metadata><Creator>test</Creator></Metadata>
+  <Page imageFilename="page.png" imageWidth="1000" imageHeight="1000">
+    <Border><Coords points="0,0 999,0 999,999 0,999"/></Border>
+    <TextRegion id="page"><Coords points="0,0 999,0 999,999 0,999"/></TextRegion>
+    <TextRegion id="column"><Coords points="100,100 500,100 500,900 100,900"/></TextRegion>
+    <TextLine id="l0"><Coords points="150,200 450,200 450,240 150,240"/></TextLine>
+    <TextLine id="l1"><Coords points="600,200 900,200 900,240 600,240"/></TextLine>
+  </Page>
+</PcGts>
+"""
+
+
+def lines(region) -> list[str]:
+    return [e['id'] for e in region if e.etype == ElementType.TextLine]
+
+
+def test_assign_nested_regions(tmp_path):
+    fp = tmp_path.joinpath('page.xml')
+    fp.write_text(PAGE, encoding='utf-8')
+    pxml = PageXML.from_xml(fp)
+    fix_pagexml(pxml, ['assign'])
+
+    page = next(iter(pxml))
+    regions = {e['id']: e for e in page if e.is_region()}
+    assert lines(regions['column']) == ['l0']  # smallest containing region
+    assert lines(regions['page']) == ['l1']
+    assert [e['id'] for e in page if e.etype == ElementType.TextLine] == []
+    assert len([e for e in page if e.etype == ElementType.Border]) == 1  # Border is not moved into a region
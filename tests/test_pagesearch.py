@@ -0,0 +1,54 @@
+import pytest
+
+from modules.analyse.pagesearch import PageSearch
+
+PAGE = """<?xml version="1.0" encoding="UTF-8"?>
+<PcGts xmlns="http://schema.primaresearch.org/PAGE/gts/pagecontent/2019-07-15">
+  <Page imageFilename="{name}.png" imageWidth="100" imageHeight="100">
+    <TextRegion id="r0">
+      <TextLine id="l0"><TextEquiv><Unicode>ein ſtarker Text</Unicode></TextEquiv></TextLine>
+    </TextRegion>
+  </Page>
+</PcGts>
+"""
+
+CONFIG = """[EXTENSIONS]
+xml = .xml
+copy =
+    .xml > .xml
+    .ocropus.nrm.png > .png
+    .nrm.png > .png
+xml_update =
+
+[COPY]
+threads = 8
+
+[EXCLUDED]
+files =
+folders =
+"""
+
+
+@pytest.mark.parametrize('mode', ['copy', 'hardlink'])
+def test_copy_same_destination(tmp_path, mode):
+    """ Two extensions mapped to the same output: inputs stay intact, the last mapping wins """
+    in_dir, out_dir = tmp_path.joinpath('in'), tmp_path.joinpath('out')
+    in_dir.mkdir()
+    pages = 200
+    for i in range(pages):
+        in_dir.joinpath(f'p{i:03d}.xml').write_text(PAGE.format(name=f'p{i:03d}'), encoding='utf-8')
+        in_dir.joinpath(f'p{i:03d}.ocropus.nrm.png').write_bytes(f'ocropus {i}'.encode() * 1000)
+        in_dir.joinpath(f'p{i:03d}.nrm.png').write_bytes(f'nrm {i}'.encode() * 1000)
+    config = tmp_path.joinpath('pagesearch.cfg')
+    config.write_text(CONFIG, encoding='utf-8')
+    search = tmp_path.joinpath('search.txt')
+    search.write_text('ſt\n', encoding='utf-8')
+
+    for _ in range(2):  # second run replaces the outputs (and hardlinks) of the first one
+        PageSearch(in_dir, out_dir, recursive=True, config=config, copy_mode=mode).search(search)
+
+    for i in range(pages):
+        assert in_dir.joinpath(f'p{i:03d}.ocropus.nrm.png').read_bytes() == f'ocropus {i}'.encode() * 1000
+        assert in_dir.joinpath(f'p{i:03d}.nrm.png').read_bytes() == f'nrm {i}'.encode() * 1000
+        assert out_dir.joinpath(f'{i + 1:05d}.png').read_bytes() == f'nrm {i}'.encode() * 1000
+    assert not list(out_dir.glob('.*.tmp'))
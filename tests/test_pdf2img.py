@@ -0,0 +1,66 @@
+import click
+import pytest
+
+fitz = pytest.importorskip('fitz')
+
+from PIL import Image
+
+from modules.parser.pdf2img import parse_pages, render_image, render_page
+
+PAGE_SIZES = [(595, 842), (612, 792), (842, 595), (500.3, 701.7), (283.5, 1000.1)]  # A4, letter, landscape, odd
+
+
+@pytest.mark.parametrize('pages, expected', [
+    (None, [1, 2, 3, 4, 5, 6, 7, 8, 9, 10]),
+    ('1-3,5', [1, 2, 3, 5]),
+    ('8-', [8, 9, 10]),
+    ('-2', [1, 2]),
+    ('3, 2-4 ,', [2, 3, 4]),
+    ('10', [10]),
+])
+def test_parse_pages(pages, expected):
+    assert parse_pages(pages, 10) == expected
+
+
+@pytest.mark.parametrize('pages, message', [
+    ('abc', 'Invalid'),
+    ('1-x', 'Invalid'),
+    ('-', 'Invalid'),
+    ('1.5', 'Invalid'),
+    ('²', 'Invalid'),
+    ('1-³', 'Invalid'),
+    ('١', 'Invalid'),
+    ('5-3', 'Reversed'),
+    ('0', 'out of range'),
+    ('11', 'out of range'),
+    ('8-12', 'out of range'),
+    ('12-', 'out of range'),
+    (',', 'Empty'),
+])
+def test_parse_pages_invalid(pages, message):
+    with pytest.raises(click.BadParameter, match=message):
+        parse_pages(pages, 10)
+
+
+@pytest.fixture(scope='module')
+def document():
+    doc = fitz.open()
+    for width, height in PAGE_SIZES:
+        page = doc.new_page(width=width, height=height)
+        page.draw_rect(fitz.Rect(10, 10, width - 10, height / 2), color=(0, 0, 0), fill=(0.5, 0.5, 0.5))
+    yield doc
+    doc.close()
+
+
+@pytest.mark.parametrize('dpi', [72, 150, 300])
+@pytest.mark.parametrize('height', [100, 777, 2000])
+def test_render_size(document, tmp_path, dpi, height):
+    """ Direct rendering at the output size gives the same size as rendering at dpi and resizing to height """
+    for n, page in enumerate(document):
+        pixmap = page.get_pixmap(dpi=dpi)
+        expected = int(height * pixmap.width / pixmap.height), height
+        outfile = tmp_path.joinpath(f'{n}.png')
+        render_page(page, outfile, height, dpi)
+        with Image.open(outfile) as img:
+            assert img.size == expected, (PAGE_SIZES[n], dpi, height)
+        assert render_image(page, height, dpi).size == expected, (PAGE_SIZES[n], dpi, height)
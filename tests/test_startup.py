@@ -0,0 +1,33 @@
+import subprocess
+import sys
+from pathlib import Path
+
+import pytest
+
+ROOT = Path(__file__).parent.parent
+HEAVY_MODULES = ['cv2', 'fitz', 'shapely', 'numpy', 'pyarrow', 'pandas', 'PIL', 'lxml', 'pagexml']
+CHECK = f"""
+import runpy
+import sys
+sys.argv = ['htrtools.py', *sys.argv[1:]]
+try:
+    runpy.run_path('htrtools.py', run_name='__main__')
+except SystemExit:
+    pass
+print('loaded:', ','.join(m for m in {HEAVY_MODULES!r} if m in sys.modules), file=sys.stderr)
+"""
+
+
+@pytest.mark.parametrize('args', [
+    ['--help'],
+    ['csv2txt', '--help'],
+    ['rename', '--help'],
+    ['pipeline', '--help'],
+])
+def test_help_does_not_import_heavy_modules(args):
+    """ Help pages of the main command and lightweight subcommands must not import heavy dependencies """
+    result = subprocess.run([sys.executable, '-c', CHECK, *args], cwd=ROOT, capture_output=True, text=True,
+                            check=True)
+    assert 'Usage:' in result.stdout
+    loaded = result.stderr.strip().splitlines()[-1].removeprefix('loaded:').strip()
+    assert loaded == '', f'heavy modules imported: {loaded}'